@@ -0,0 +1,311 @@
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import requests
+
+import config
+import instrument
+import memo
+from data import get_panel, get_renewal, get_smoothed, province_ranges
+
+# Bumped whenever the columns or encoding of the responses change, so clients
+# holding an old ETag refetch
+API_VERSION = 1
+
+FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "json": "application/json",
+}
+# Archived vintages never change, so past dates can be cached for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+class Export:
+    """The panel of one as_of_date with its smoothed and renewal columns.
+
+    Rows are sorted by province and date, so the rows of a province are a
+    slice and a date range within it is two binary searches. `version`
+    identifies the contents and goes into every ETag.
+    """
+
+    def __init__(self, frame, as_of_date):
+        self.frame = frame.reset_index(drop=True)
+        self.as_of_date = as_of_date
+        self.ranges = province_ranges(self.frame)
+        self.dates = self.frame["Date"].to_numpy()
+        digest = pd.util.hash_pandas_object(self.frame, index=False).to_numpy()
+        self.version = hashlib.sha1(digest.tobytes()).hexdigest()[:16]
+
+    def provinces(self):
+        abbrs = config.load_province_data().set_index("name")["abbr"]
+        return [
+            {"name": name, "abbr": abbrs.get(name), "rows": int(hi - lo)}
+            for name, (lo, hi) in self.ranges.items()
+        ]
+
+    def rows(self, province=None, start=None, end=None):
+        # Positions of the rows of `province` (all if None) within [start, end]
+        ranges = self.ranges.values()
+        if province is not None:
+            ranges = [self.ranges.get(province, (0, 0))]
+        positions = []
+        for lo, hi in ranges:
+            dates = self.dates[lo:hi]
+            first = 0 if start is None else dates.searchsorted(start)
+            last = len(dates) if end is None else dates.searchsorted(end, "right")
+            positions.append(np.arange(lo + first, lo + last))
+        return np.concatenate(positions) if positions else np.arange(0)
+
+    def query(self, province=None, start=None, end=None, columns=None):
+        df = self.frame.take(self.rows(province, start, end))
+        return df if columns is None else df[columns]
+
+
+@lru_cache(maxsize=4)
+@instrument.timed()
+def get_export(as_of_date):
+    frame = get_panel(as_of_date)
+    frame = frame.join(get_smoothed(as_of_date)).join(get_renewal(as_of_date))
+    return Export(frame, as_of_date)
+
+
+def encode(df, fmt):
+    # Arrow IPC stream, or JSON in pandas' "split" layout
+    if fmt == "arrow":
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    return df.to_json(orient="split", index=False, date_format="iso").encode()
+
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_date(value, name):
+    try:
+        return np.datetime64(datetime.date.fromisoformat(value), "ns")
+    except ValueError:
+        raise BadRequest(400, f"{name} must be a YYYY-MM-DD date, not {value!r}")
+
+
+class ApiServer:
+    """Local HTTP API serving the computed province panels.
+
+        GET /provinces
+        GET /panel                all provinces
+        GET /panel/<name or abbr> one province
+
+    /panel takes `start` and `end` dates (inclusive), `columns` (comma
+    separated), `format` (arrow or json; the Accept header is used if it is
+    omitted) and `as_of` (an archived date, defaulting to the server's
+    `as_of_date`, or to the day of the request if it has none). JSON is
+    gzipped for clients that accept it. Every response carries an ETag tied
+    to the data it was built from, so a conditional GET is answered with a
+    304 before anything is queried or encoded, and a Cache-Control max-age
+    running to the next upstream refresh (a year, and immutable, for past
+    dates asked for explicitly, which never change). Encoded bodies are
+    memoized by ETag.
+
+    `export` serves a fixed Export instead of loading one per as_of date.
+
+        with ApiServer(port=8000) as server:
+            ...
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, as_of_date=None, export=None):
+        self.as_of_date = as_of_date
+        self.export = export
+        self.bodies = memo.Memo(maxsize=256, ttl=3600)
+        self.requests = 0
+        self.not_modified = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.url = f"http://{host}:{self.server.server_port}"
+
+    def get_export(self, as_of_date):
+        if self.export is not None:
+            return self.export
+        try:
+            return get_export(as_of_date)
+        except FileNotFoundError:
+            raise BadRequest(404, f"No data was archived on or before {as_of_date}")
+        except (requests.RequestException, OSError):
+            raise BadRequest(503, f"The data of {as_of_date} cannot be loaded")
+
+    def max_age(self, as_of_date, explicit):
+        # Without an explicit date the same URL serves tomorrow's data tomorrow
+        if explicit and as_of_date < datetime.date.today():
+            return IMMUTABLE_MAX_AGE
+        remaining = memo.next_refresh(as_of_date) - datetime.datetime.now().timestamp()
+        return max(int(remaining), 0)
+
+    def route(self, path, query, headers):
+        # (content type, ETag, max-age, compress, build) for a request, where
+        # build() returns the uncompressed body
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if parts != ["provinces"] and not (parts[0] == "panel" and len(parts) <= 2):
+            raise BadRequest(404, f"No such resource {path}")
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        as_of_date = self.as_of_date or datetime.date.today()
+        explicit = self.as_of_date is not None
+        if "as_of" in params and self.export is None:
+            try:
+                as_of_date = datetime.date.fromisoformat(params["as_of"])
+            except ValueError:
+                raise BadRequest(400, "as_of must be a YYYY-MM-DD date")
+            if as_of_date > datetime.date.today():
+                raise BadRequest(400, f"as_of {as_of_date} is in the future")
+            explicit = True
+        export = self.get_export(as_of_date)
+
+        if parts == ["provinces"]:
+            fmt, compress = "json", False
+
+            def build():
+                return json.dumps(export.provinces()).encode()
+
+        else:
+            province = None
+            if len(parts) == 2:
+                try:
+                    province = config.Province(parts[1]).name
+                except KeyError:
+                    raise BadRequest(404, f"Unknown province {parts[1]!r}")
+            start = end = None
+            if "start" in params:
+                start = parse_date(params["start"], "start")
+            if "end" in params:
+                end = parse_date(params["end"], "end")
+            columns = None
+            if params.get("columns"):
+                columns = params["columns"].split(",")
+                unknown = set(columns).difference(export.frame.columns)
+                if unknown:
+                    raise BadRequest(400, f"Unknown columns {sorted(unknown)}")
+                columns = ["Date", "Province"] + [
+                    col for col in columns if col not in ["Date", "Province"]
+                ]
+
+            fmt = params.get("format")
+            if fmt is None:
+                accept = headers.get("Accept", "")
+                fmt = "arrow" if FORMATS["arrow"] in accept else "json"
+            if fmt not in FORMATS:
+                raise BadRequest(400, f"format must be one of {list(FORMATS)}")
+            compress = fmt == "json" and "gzip" in headers.get("Accept-Encoding", "")
+
+            def build():
+                df = export.query(province, start, end, columns)
+                return encode(df, fmt)
+
+        request = json.dumps([parts, sorted(params.items()), fmt, compress])
+        key = hashlib.sha1(request.encode()).hexdigest()[:16]
+        etag = f'"{API_VERSION}-{export.version}-{key}"'
+        max_age = self.max_age(export.as_of_date, explicit)
+        return FORMATS[fmt], etag, max_age, compress, build
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes; without this the body of
+            # a kept-alive response waits on the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                with api.lock:
+                    api.requests += 1
+                try:
+                    content_type, etag, max_age, compress, build = api.route(
+                        parts.path, parts.query, self.headers
+                    )
+                except BadRequest as error:
+                    self.send_error(error.status, str(error))
+                    return
+                except Exception:
+                    # Every request gets a response, whatever went wrong
+                    self.send_error(500)
+                    return
+
+                cache_control = f"public, max-age={max_age}"
+                if max_age == IMMUTABLE_MAX_AGE:
+                    cache_control += ", immutable"
+                if self.headers.get("If-None-Match") == etag:
+                    with api.lock:
+                        api.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", cache_control)
+                    self.end_headers()
+                    return
+
+                def encoded():
+                    body = build()
+                    return gzip.compress(body, compresslevel=5) if compress else body
+
+                try:
+                    body = api.bodies.get(etag, encoded)
+                except Exception:
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if compress:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Vary", "Accept, Accept-Encoding")
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", cache_control)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=ApiServer.__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--as-of", type=datetime.date.fromisoformat)
+    args = parser.parse_args()
+
+    server = ApiServer(args.host, args.port, args.as_of)
+    server.get_export(args.as_of or datetime.date.today())
+    served = args.as_of or "the day of each request"
+    print(f"Serving the panels of {served} at {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import instrument
+
+# A full copy is stored every CHECKPOINT_EVERY vintages, so reconstructing any
+# vintage reads at most that many files
+CHECKPOINT_EVERY = 30
+REMOVED = "_removed"
+
+
+def decode_dictionaries(table):
+    # `table` with its dictionary (categorical) columns as plain values, and
+    # their names. A delta mixes categories of two vintages, which pandas
+    # stores as strings, so files of one source may disagree on the type.
+    names = []
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            names.append(field.name)
+            values = table.column(i).cast(field.type.value_type)
+            table = table.set_column(i, field.name, values)
+    return table, names
+
+
+class Archive:
+    """Every vintage of one upstream source, stored as deltas.
+
+    Each vintage is an uncompressed Arrow (Feather v2) file, memory mapped when
+    read, named <as_of_date>.full.arrow for a complete copy or
+    <as_of_date>.delta.arrow for only the rows appended or revised since the
+    previous vintage, plus the rows it dropped (flagged in the _removed
+    column). Rows are identified by `keys`. Vintages are appended in date
+    order; writing one that is already stored is a no-op.
+    """
+
+    def __init__(self, directory, keys=("Province", "Date")):
+        self.directory = Path(directory)
+        self.keys = list(keys)
+
+    def files(self):
+        # {as_of_date: path} in date order
+        paths = sorted(self.directory.glob("*.arrow"))
+        return {path.name.split(".")[0]: path for path in paths}
+
+    def vintages(self):
+        return list(self.files())
+
+    def size(self):
+        return sum(path.stat().st_size for path in self.files().values())
+
+    @instrument.timed("archive:read")
+    def read(self, as_of_date):
+        # The source exactly as pulled on `as_of_date`, sorted by `keys`
+        files = self.files()
+        dates = list(files)
+        if str(as_of_date) not in files:
+            raise FileNotFoundError(f"No vintage for {as_of_date} in {self.directory}")
+        end = dates.index(str(as_of_date)) + 1
+        start = max(
+            i for i in range(end) if files[dates[i]].name.endswith(".full.arrow")
+        )
+        tables, categorical = [], set()
+        for date in dates[start:end]:
+            table = feather.read_table(files[date], memory_map=True)
+            table, names = decode_dictionaries(table)
+            tables.append(table)
+            categorical.update(names)
+        df = pa.concat_tables(tables, promote_options="permissive").to_pandas()
+        # Rows of later vintages replace those of earlier ones
+        df = df.drop_duplicates(self.keys, keep="last")
+        df = df[~df.pop(REMOVED).to_numpy(dtype=bool)]
+        df = df.astype({col: "category" for col in categorical})
+        return df.sort_values(self.keys, kind="stable").reset_index(drop=True)
+
+    def delta(self, old, new):
+        # Rows of `new` that are not in `old` or differ from it, and the rows
+        # of `old` that `new` no longer has. None if the two cannot be
+        # compared row by row.
+        old_index = pd.MultiIndex.from_frame(old[self.keys])
+        new_index = pd.MultiIndex.from_frame(new[self.keys])
+        if (
+            list(old.columns) != list(new.columns)
+            or not old_index.is_unique
+            or not new_index.is_unique
+        ):
+            return None
+        position = old_index.get_indexer(new_index)
+        found = np.flatnonzero(position >= 0)
+        changed = position < 0
+        for col in new.columns.drop(self.keys):
+            ours = new[col].to_numpy()[found]
+            theirs = old[col].to_numpy()[position[found]]
+            differ = (ours != theirs) & ~(pd.isna(ours) & pd.isna(theirs))
+            changed[found[differ]] = True
+        removed = ~old_index.isin(new_index)
+        return pd.concat(
+            [
+                new[changed].assign(**{REMOVED: False}),
+                old[removed].assign(**{REMOVED: True}),
+            ],
+            ignore_index=True,
+        )
+
+    @instrument.timed("archive:write")
+    def write(self, as_of_date, df):
+        files = self.files()
+        dates = list(files)
+        if str(as_of_date) in files:
+            # Already stored, by another session that refreshed concurrently
+            return files[str(as_of_date)]
+        if dates and str(as_of_date) < dates[-1]:
+            raise ValueError(
+                f"Vintage {as_of_date} is before the latest one, {dates[-1]}"
+            )
+
+        table = None
+        since_full = 0
+        for date in reversed(dates):
+            if files[date].name.endswith(".full.arrow"):
+                break
+            since_full += 1
+        if dates and since_full + 1 < CHECKPOINT_EVERY:
+            table = self.delta(self.read(dates[-1]), df)
+        kind = "delta" if table is not None else "full"
+        if table is None:
+            table = df.assign(**{REMOVED: False}).reset_index(drop=True)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{as_of_date}.{kind}.arrow"
+        # Unique, so concurrent writers of one vintage cannot move each other's
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, path)
+        return path
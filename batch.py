@@ -0,0 +1,100 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import config
+from data import SMOOTHING_WINDOWS, Data, get_panel
+from intervention_analysis import plot_immunity, plot_R
+
+# Bumped whenever the layout or contents of the artifacts change
+ARTIFACT_VERSION = 2
+
+
+def artifact_dir(output, as_of_date):
+    return Path(output) / f"v{ARTIFACT_VERSION}" / str(as_of_date)
+
+
+def provinces():
+    names = config.province_data["name"]
+    return [name for name in names if name not in ["Repatriated"]]
+
+
+def build_province(province, panel, as_of_date, directory):
+    # Runs in a worker process: everything a page view of `province` needs
+    data = Data(province, panel, as_of_date)
+    abbr = data.province.abbr
+    data.data.join(data.smoothed).join(data.renewal).to_parquet(
+        directory / f"{abbr}.parquet"
+    )
+    specs = {f"plot_R_{window}d": plot_R(data, window) for window in SMOOTHING_WINDOWS}
+    for window in SMOOTHING_WINDOWS:
+        specs[f"plot_R_renewal_{window}d"] = plot_R(data, window, estimator="Renewal")
+    specs["plot_immunity"] = plot_immunity(data)
+    for name, chart in specs.items():
+        with open(directory / f"{abbr}.{name}.json", "w") as f:
+            f.write(chart.to_json(indent=None))
+    return {"name": data.province.name, "abbr": abbr, "rows": len(data.data)}
+
+
+def run(as_of_date, output, workers=None):
+    """Precompute every province's data and chart specs for `as_of_date`.
+
+    Artifacts are written to a temporary directory next to the final one and
+    moved into place when complete, so readers never see a partial run.
+    """
+    panel = get_panel(as_of_date)
+    final = artifact_dir(output, as_of_date)
+    staging = final.with_name(final.name + ".tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    names = provinces()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                build_province,
+                name,
+                panel[panel["Province"] == name],
+                as_of_date,
+                staging,
+            )
+            for name in names
+        ]
+        built = [future.result() for future in futures]
+
+    manifest = {
+        "version": ARTIFACT_VERSION,
+        "as_of_date": str(as_of_date),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "windows": list(SMOOTHING_WINDOWS),
+        "provinces": built,
+    }
+    with open(staging / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(final, ignore_errors=True)
+    os.replace(staging, final)
+    return final
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute every province's metrics and chart specs"
+    )
+    parser.add_argument(
+        "--as-of-date",
+        type=datetime.date.fromisoformat,
+        default=datetime.date.today(),
+    )
+    parser.add_argument("--output", default="artifacts")
+    parser.add_argument("--workers", type=int, help="Defaults to the CPU count")
+    args = parser.parse_args()
+    print(run(args.as_of_date, args.output, args.workers))
+
+
+if __name__ == "__main__":
+    main()
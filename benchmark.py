@@ -0,0 +1,902 @@
+import argparse
+import datetime
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import data
+from data import (
+    VACCINE_START_DATE,
+    Data,
+    build_panel,
+    make_immunity_monotonic,
+    read_case_csv,
+)
+
+
+@lru_cache(maxsize=1)
+def bundled_province_data():
+    return pd.read_csv(config.BUNDLED_PROVINCE_DATA)
+
+
+# Benchmarks run on the bundled province metadata, so that neither they nor
+# load_test's synthetic server download it or write to the user's cache
+config.load_province_data = bundled_province_data
+
+
+def legacy_make_immunity_monotonic(data):
+    # The original fixed-point loop, kept as the reference implementation
+    while not data["Total Vaccinated"].is_monotonic_increasing:
+        data.loc[data["Date"] < VACCINE_START_DATE, "Total Vaccinated"] = 0
+        data["vacc_diff"] = data["Total Vaccinated"].diff()
+        data.loc[data["vacc_diff"] <= 0, "Total Vaccinated"] = np.nan
+        data["Total Vaccinated"] = (
+            data["Total Vaccinated"].ffill().fillna(0).astype(int)
+        )
+    data = data.drop("vacc_diff", axis=1, errors="ignore")
+    return data
+
+
+def noisy_vaccine_series(n_rows, n_provinces=13, seed=0):
+    # Cumulative totals with frequent downward revisions
+    rng = np.random.default_rng(seed)
+    per_province = n_rows // n_provinces
+    dates = pd.date_range("2020-12-01", periods=per_province, freq="D")
+    steps = rng.integers(0, 1000, size=(n_provinces, per_province))
+    totals = steps.cumsum(axis=1)
+    revisions = rng.random((n_provinces, per_province)) < 0.1
+    totals = totals - revisions * rng.integers(0, 5000, size=totals.shape)
+    return pd.DataFrame(
+        {
+            "Province": np.repeat([f"P{i}" for i in range(n_provinces)], per_province),
+            "Date": np.tile(dates, n_provinces),
+            "Total Vaccinated": totals.ravel().clip(min=0),
+        }
+    )
+
+
+def synthetic_cases(provinces, n_days, seed=0):
+    # Frame with the schema get_case_data produces
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-03-01", periods=n_days, freq="D")
+    new = rng.poisson(200, size=(len(provinces), n_days))
+    total = new.cumsum(axis=1)
+    deaths = total // 100
+    recovered = np.maximum(total - 14 * 200, 0)
+    return pd.DataFrame(
+        {
+            "Province": pd.Categorical(np.repeat(provinces, n_days)),
+            "Date": np.tile(dates, len(provinces)),
+            "New Cases": new.ravel(),
+            "Total Recovered": recovered.ravel(),
+            "New Deaths": np.diff(deaths, axis=1, prepend=0).ravel(),
+            "Total Cases": total.ravel(),
+            "Total Deaths": deaths.ravel(),
+            "New Recovered": np.diff(recovered, axis=1, prepend=0).ravel(),
+            "Active Cases": (total - recovered - deaths).ravel(),
+        }
+    ).astype({col: "int32" for col in data.CASE_COUNT_COLUMNS})
+
+
+def synthetic_vaccines(provinces, n_days, seed=1):
+    # Frame with the schema get_vaccine_history produces
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(VACCINE_START_DATE - pd.Timedelta(days=20), periods=n_days)
+    new = rng.poisson(2000, size=(len(provinces), n_days))
+    return pd.DataFrame(
+        {
+            "Date": np.tile(dates, len(provinces)),
+            "Province": np.repeat(provinces, n_days),
+            "New Vaccinated": new.ravel(),
+            "Total Vaccinated": new.cumsum(axis=1).ravel(),
+        }
+    )
+
+
+def synthetic_inputs(region_scale=1, history_scale=1):
+    # Case and vaccine frames for the 13 provinces times `region_scale`
+    # (extra regions are named "Region <n>") over ~2 years times
+    # `history_scale`, with their populations
+    provinces = list(config.province_data["name"])
+    regions = provinces + [
+        f"Region {i}" for i in range(len(provinces) * (region_scale - 1))
+    ]
+    n_days = 730 * history_scale
+    population = pd.Series(
+        np.random.default_rng(2).integers(10**5, 10**7, len(regions)), index=regions
+    )
+    population[provinces] = config.province_data.set_index("name")["population"]
+    cases = synthetic_cases(regions, n_days)
+    vaccines = synthetic_vaccines(regions, n_days - 300)
+    return cases, vaccines, population
+
+
+def synthetic_regions(n_regions, history_scale=1, seed=3):
+    # Region metadata, regional case and death feeds (normalized, as
+    # regions.get_region_data reads them) and provincial vaccines for
+    # `n_regions` health regions spread over the provinces, whose populations
+    # split each province's
+    from regions import COUNTRY
+
+    provinces = config.province_data
+    rng = np.random.default_rng(seed)
+    province = np.arange(n_regions) % len(provinces)
+    weight = pd.Series(rng.random(n_regions) + 0.1)
+    share = weight / weight.groupby(province).transform("sum")
+    regions = pd.DataFrame(
+        {
+            "Region": [
+                f"Region {i} ({provinces['abbr'].iloc[p]})"
+                for i, p in enumerate(province)
+            ],
+            "Province": provinces["name"].to_numpy()[province],
+            "Country": COUNTRY,
+            "population": np.floor(
+                provinces["population"].to_numpy()[province] * share
+            ),
+        }
+    )
+    n_days = 730 * history_scale
+    feed = synthetic_cases(list(regions["Region"]), n_days, seed).rename(
+        columns={"Province": "Region"}
+    )
+    feed = feed.merge(regions[["Region", "Province", "Country"]], on="Region")
+    cases = feed[["Region", "Province", "Country", "Date", "New Cases", "Total Cases"]]
+    deaths = feed[["Region", "Date", "New Deaths", "Total Deaths"]]
+    vaccines = synthetic_vaccines(list(provinces["name"]), n_days - 300)
+    return regions, cases, deaths, vaccines
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_immunity_monotonic(sizes, repeat, legacy_limit):
+    # Exits non-zero if the result differs from the legacy loop at any size
+    mismatched = False
+    for n_rows in sizes:
+        df = noisy_vaccine_series(n_rows)
+        new = best_of(lambda: make_immunity_monotonic(df), repeat)
+        line = f"make_immunity_monotonic n={len(df):>8}: {new * 1e3:9.2f} ms"
+        if len(df) <= legacy_limit:
+            legacy = df.groupby("Province", group_keys=False).apply(
+                lambda g: legacy_make_immunity_monotonic(g.copy())
+            )
+            expected = legacy["Total Vaccinated"].sort_index().to_numpy()
+            actual = make_immunity_monotonic(df)["Total Vaccinated"].to_numpy()
+            old = best_of(
+                lambda: df.groupby("Province", group_keys=False).apply(
+                    lambda g: legacy_make_immunity_monotonic(g.copy())
+                ),
+                1,
+            )
+            equal = np.array_equal(expected, actual)
+            mismatched |= not equal
+            line += f"  legacy: {old * 1e3:9.2f} ms"
+            line += f"  equal: {equal}"
+        print(line)
+    if mismatched:
+        sys.exit(1)
+
+
+def import_time(module):
+    # Cumulative import time of `module` in microseconds, in a fresh interpreter
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if name.strip() == module:
+            return int(cumulative)
+
+
+def bench_imports(modules, repeat):
+    for module in modules:
+        best = min(import_time(module) for _ in range(repeat))
+        print(f"import {module:<24} {best / 1e3:9.2f} ms")
+
+
+def legacy_read_case_csv(source):
+    # The original ingestion: default dtypes, then strip separators per column
+    df = pd.read_csv(source, parse_dates=["date"])
+    col_names = {
+        "prname": "Province",
+        "date": "Date",
+        "numtoday": "New Cases",
+        "numrecover": "Total Recovered",
+        "numdeathstoday": "New Deaths",
+        "numtotal": "Total Cases",
+        "numdeaths": "Total Deaths",
+        "numrecoveredtoday": "New Recovered",
+        "numactive": "Active Cases",
+    }
+    df.rename(columns=col_names, inplace=True)
+    df = df[col_names.values()]
+    int_cols = {
+        col: int for col in df.columns[~df.columns.isin(["Province", "Date"])].to_list()
+    }
+    for col in int_cols:
+        try:
+            df[col] = df[col].str.replace(",", "")
+        except AttributeError:
+            pass
+    df = df.fillna(0)
+    df = df.astype(dtype=int_cols)
+    return df
+
+
+def write_synthetic_case_csv(path, scale, seed=0):
+    # Roughly the shape of covid19-download.csv (15 regions, ~2 years, ~40
+    # columns) repeated `scale` times over more regions. Large counts are
+    # written with thousands separators, and some cells are left blank.
+    rng = np.random.default_rng(seed)
+    n_regions, n_days = 15 * scale, 730
+    dates = pd.date_range("2020-03-01", periods=n_days, freq="D")
+    n_rows = n_regions * n_days
+    new = rng.integers(0, 5000, size=(n_regions, n_days))
+    total = new.cumsum(axis=1).ravel()
+    df = pd.DataFrame(
+        {
+            "pruid": np.repeat(np.arange(n_regions), n_days),
+            "prname": np.repeat([f"Region {i}" for i in range(n_regions)], n_days),
+            "prnameFR": np.repeat([f"Région {i}" for i in range(n_regions)], n_days),
+            "date": np.tile(dates.strftime("%Y-%m-%d"), n_regions),
+            "numtotal": [f"{v:,}" for v in total],
+            "numtoday": new.ravel(),
+            "numdeaths": total // 100,
+            "numdeathstoday": new.ravel() // 100,
+            "numrecover": np.where(rng.random(n_rows) < 0.2, np.nan, total * 0.9),
+            "numrecoveredtoday": new.ravel() * 0.9,
+            "numactive": total // 10,
+        }
+    )
+    for i in range(30):
+        df[f"rate{i}"] = rng.random(n_rows).round(2)
+    df.to_csv(path, index=False)
+    return n_rows
+
+
+def ingest_worker(path, mode, chunksize):
+    # Runs in its own process so ru_maxrss is the peak of this parse alone
+    start = time.perf_counter()
+    if mode == "legacy":
+        df = legacy_read_case_csv(path)
+    else:
+        df = read_case_csv(path, chunksize=chunksize)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = {
+        "seconds": elapsed,
+        "peak_rss_mb": peak_kb / 1024,
+        "frame_mb": df.memory_usage(deep=True).sum() / 2**20,
+    }
+    print(json.dumps(result))
+
+
+def bench_ingest(scales, chunksize):
+    modes = [("legacy", 0), ("typed", 0), ("typed", chunksize)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            path = f"{tmp}/cases_{scale}x.csv"
+            # Written from a child process too: ru_maxrss carries over from
+            # the parent at fork, which would hide the workers' own peaks
+            result = subprocess.run(
+                [sys.executable, __file__, "_write", path, str(scale)],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            n_rows = int(result.stdout)
+            for mode, chunks in modes:
+                result = subprocess.run(
+                    [sys.executable, __file__, "_ingest", path, mode, str(chunks)],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                r = json.loads(result.stdout)
+                label = mode if not chunks else f"{mode} (chunks of {chunks})"
+                print(
+                    f"{scale:>4}x ({n_rows:>9} rows) {label:<26}"
+                    f" {r['seconds']:7.2f} s  peak RSS {r['peak_rss_mb']:8.1f} MB"
+                    f"  frame {r['frame_mb']:7.1f} MB"
+                )
+
+
+def bench_memory(region_scale, history_scale, budget_mb):
+    # Peak traced memory of each pipeline stage on synthetic inputs, and the
+    # size of what it returns. Exits non-zero if the pipeline's overall peak,
+    # over the memory already held by the inputs, is over budget.
+    import tracemalloc
+
+    from renewal import renewal_R
+
+    cases, vaccines, population = synthetic_inputs(region_scale, history_scale)
+    frames = {}
+    stages = [
+        ("resample_daily", lambda: data.resample_daily(cases)),
+        (
+            "add_vaccinated",
+            lambda: data.add_vaccinated(frames.pop("resample_daily"), vaccines),
+        ),
+        (
+            "add_immunity",
+            lambda: data.add_immunity(frames["add_vaccinated"], population),
+        ),
+        ("calculate_R", lambda: data.calculate_R(frames["add_immunity"], population)),
+        (
+            "rolling_means",
+            lambda: data.rolling_means(frames["calculate_R"], data.SMOOTHED_COLUMNS),
+        ),
+        ("renewal_R", lambda: renewal_R(frames["calculate_R"])),
+        ("Data", lambda: Data("Saskatchewan", frames["calculate_R"]).data),
+    ]
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    overall = 0
+    print(f"{'stage':<16} {'seconds':>8} {'peak MB':>9}")
+    for name, run in stages:
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        frames[name] = run()
+        seconds = time.perf_counter() - start
+        peak = (tracemalloc.get_traced_memory()[1] - baseline) / 2**20
+        overall = max(overall, peak)
+        print(f"{name:<16} {seconds:8.2f} {peak:9.1f}")
+    tracemalloc.stop()
+    # The first three stages add their columns to one frame
+    panel = ("panel", frames["calculate_R"])
+    del frames["add_vaccinated"], frames["add_immunity"], frames["calculate_R"]
+    print(data.memory_report(dict([panel], **frames)))
+    print(f"peak {overall:.1f} MB (budget {budget_mb} MB)")
+    if overall > budget_mb:
+        sys.exit(1)
+
+
+def bench_charts(years, budget_kb):
+    # Serialized Vega-Lite spec size of each chart for one province over
+    # `years` of history. Exits non-zero if any spec is over budget.
+    import intervention_analysis
+
+    provinces = list(config.province_data["name"])
+    n_days = int(365 * years)
+    population = config.province_data.set_index("name")["population"]
+    panel = build_panel(
+        synthetic_cases(provinces, n_days),
+        synthetic_vaccines(provinces, n_days),
+        population,
+    )
+    data = Data("Saskatchewan", panel)
+    charts = {
+        "plot_R": lambda: intervention_analysis.plot_R(data, 7),
+        "plot_immunity": lambda: intervention_analysis.plot_immunity(data),
+    }
+    over_budget = False
+    for name, build in charts.items():
+        size = len(build().to_json(indent=None).encode())
+        over_budget |= size > budget_kb * 1024
+        print(f"{name:<16} {size / 1024:8.1f} KB (budget {budget_kb} KB)")
+    if over_budget:
+        sys.exit(1)
+
+
+def bench_interventions(sizes, repeat):
+    # Load time of the intervention index and the cost of one province's
+    # date-range query, against filtering the whole frame as plot_R used to
+    for size in sizes:
+        rng = np.random.default_rng(0)
+        regions = [f"R{i}" for i in range(max(size // 100, 1))]
+        df = pd.DataFrame(
+            {
+                "abbr": rng.choice(regions, size),
+                "Date": pd.Timestamp("2020-03-01")
+                + pd.to_timedelta(rng.integers(0, 730, size), unit="D"),
+                "Measure": "Synthetic measure",
+                "Type": rng.choice(["Tighten", "Ease", "Event"], size),
+            }
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/interventions.csv"
+            df.to_csv(path, index=False)
+            frame = config.read_interventions(path)
+            load = best_of(
+                lambda: config.InterventionIndex(config.read_interventions(path)),
+                repeat,
+            )
+        index = config.InterventionIndex(frame)
+        start, end = pd.Timestamp("2020-06-01"), pd.Timestamp("2020-12-31")
+
+        def scan():
+            rows = frame[frame["abbr"] == "R0"]
+            return rows[(rows["Date"] >= start) & (rows["Date"] <= end)]
+
+        indexed = best_of(lambda: index.query("R0", start, end), repeat)
+        scanned = best_of(scan, repeat)
+        print(
+            f"{size:>9,} measures: load {load * 1000:7.1f} ms, query "
+            f"{indexed * 1e6:7.1f} us (filter {scanned * 1e6:8.1f} us)"
+        )
+
+
+def bench_archive(vintages, revisions):
+    # Archive `vintages` daily pulls of the synthetic case data, each adding a
+    # day and revising `revisions` recent rows, and compare the archive's size
+    # with one Parquet copy per pull. Every fifth pull leaves out a province,
+    # so the Province categories change between vintages. Exits non-zero if a
+    # vintage does not read back as it was written.
+    import io
+
+    from archive import Archive
+
+    cases, _, _ = synthetic_inputs()
+    dates = np.sort(cases["Date"].unique())[-vintages:]
+    missing = cases["Province"].cat.categories[0]
+    step = max(vintages // 4, 1)
+    rng = np.random.default_rng(0)
+    writes, parquet_bytes, pulls = [], 0, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = Archive(tmp)
+        for i, date in enumerate(dates):
+            pull = cases[cases["Date"] <= date].copy()
+            recent = np.flatnonzero(pull["Date"] > date - np.timedelta64(14, "D"))
+            revised = pull.index[rng.choice(recent, revisions, replace=False)]
+            pull.loc[revised, "New Cases"] += 1
+            if i % 5 == 4:
+                pull = pull[pull["Province"] != missing]
+                pull["Province"] = pull["Province"].cat.remove_unused_categories()
+            start = time.perf_counter()
+            archive.write(pd.Timestamp(date).date(), pull)
+            writes.append(time.perf_counter() - start)
+            body = io.BytesIO()
+            pull.to_parquet(body, index=False)
+            parquet_bytes += len(body.getvalue())
+            if i % step == 0 or i % 5 in (4, 0):
+                pulls[archive.vintages()[-1]] = pull
+
+        print(
+            f"{vintages} vintages: archive {archive.size() / 2**20:.2f} MB, "
+            f"Parquet copies {parquet_bytes / 2**20:.2f} MB, "
+            f"{np.mean(writes) * 1000:.1f} ms per write"
+        )
+        for vintage in archive.vintages()[::step]:
+            seconds = best_of(lambda: archive.read(vintage), 3)
+            print(f"read {vintage}: {seconds * 1000:7.1f} ms")
+
+        mismatched = []
+        for vintage, pull in pulls.items():
+            expected = pull.sort_values(["Province", "Date"], kind="stable")
+            read = archive.read(vintage).astype({"Province": str})
+            expected = expected.astype({"Province": str}).reset_index(drop=True)
+            if not read.equals(expected):
+                mismatched.append(vintage)
+        print(f"round trip of {len(pulls)} vintages: {not mismatched}")
+        if mismatched:
+            print(f"mismatched: {mismatched}")
+            sys.exit(1)
+
+
+def bench_sir(scenarios, days, provinces, workers, repeat):
+    # Time the SIR ensemble projection of `provinces` provinces
+    import sir
+
+    cases, vaccines, population = synthetic_inputs()
+    panel = build_panel(cases, vaccines, population)
+    panel = panel[panel["Province"].isin(population.index[:provinces])]
+    ensemble = sir.sample_scenarios(scenarios)
+    seconds = best_of(
+        lambda: sir.project(panel, population, ensemble, days, workers), repeat
+    )
+    print(
+        f"{provinces} province(s) x {scenarios:,} scenarios x {days} days: "
+        f"{seconds:.2f}s ({seconds / provinces:.2f}s per province)"
+    )
+
+
+def bench_uncertainty(samples, estimator, workers, repeat):
+    # Time the Monte Carlo bands of every province
+    import uncertainty
+
+    cases, vaccines, population = synthetic_inputs()
+    panel = build_panel(cases, vaccines, population)
+    assumptions = uncertainty.sample_assumptions(samples)
+    seconds = best_of(
+        lambda: uncertainty.bands(
+            panel, population, assumptions, estimator=estimator, workers=workers
+        ),
+        repeat,
+    )
+    provinces = panel["Province"].nunique()
+    print(
+        f"{provinces} provinces x {samples:,} samples x {len(panel) // provinces} "
+        f"days ({estimator}): {seconds:.2f}s ({seconds / provinces:.2f}s per province)"
+    )
+
+
+def bench_regions(n_regions, history_scale, budget, repeat):
+    # Time of each stage of the health-region pipeline, from the normalized
+    # feeds to one region's charts. Exits non-zero if the total is over
+    # `budget` seconds.
+    import intervention_analysis
+    import regions as hierarchy
+
+    regions, cases, deaths, vaccines = synthetic_regions(n_regions, history_scale)
+    frames = {}
+    stages = [
+        ("region_case_data", lambda: hierarchy.region_case_data(cases, deaths)),
+        (
+            "build_levels",
+            lambda: hierarchy.build_levels(
+                frames["region_case_data"], vaccines, regions
+            ),
+        ),
+        (
+            "smooth_levels",
+            lambda: hierarchy.smooth_levels(frames["build_levels"], regions),
+        ),
+        (
+            "charts",
+            lambda: [
+                chart(
+                    hierarchy.RegionData(
+                        regions["Region"].iloc[0], levels=frames["smooth_levels"]
+                    )
+                ).to_dict()
+                for chart in [
+                    lambda data: intervention_analysis.plot_R(data, 7),
+                    intervention_analysis.plot_immunity,
+                ]
+            ],
+        ),
+    ]
+    total = 0
+    print(f"{'stage':<18} {'seconds':>8}")
+    for name, run in stages:
+        seconds = best_of(lambda: frames.__setitem__(name, run()), repeat)
+        total += seconds
+        print(f"{name:<18} {seconds:8.3f}")
+    levels = frames["build_levels"]
+    print(
+        ", ".join(
+            f"{panel[level].nunique()} {level.lower()} series ({len(panel):,} rows)"
+            for level, panel in levels.items()
+        )
+    )
+    print(f"total {total:.2f}s (budget {budget}s)")
+    if total > budget:
+        sys.exit(1)
+
+
+def synthetic_upstream(scale=1):
+    # Bodies in the format of each upstream source, keyed by their real URLs
+    with tempfile.TemporaryDirectory() as tmp:
+        write_synthetic_case_csv(f"{tmp}/cases.csv", scale)
+        with open(f"{tmp}/cases.csv", "rb") as f:
+            cases = f.read()
+    provinces = config.province_data
+    vaccines = synthetic_vaccines(list(provinces["abbr"]), 300)
+    vaccines["Date"] = vaccines["Date"].dt.strftime("%Y-%m-%d")
+    vaccines = vaccines.rename(
+        columns={
+            "Date": "date_vaccine_administered",
+            "Province": "province",
+            "New Vaccinated": "avaccine",
+            "Total Vaccinated": "cumulative_avaccine",
+        }
+    )
+    provinces = provinces.rename(
+        columns={"name": "province_full", "abbr": "province_short", "population": "pop"}
+    )
+    return {
+        config.PROVINCE_DATA_URL: json.dumps(
+            {"prov": provinces.to_dict("records")}
+        ).encode(),
+        data.CASE_DATA_URL: cases,
+        data.VACCINE_DATA_URL: json.dumps(
+            {"avaccine": vaccines.to_dict("records")}
+        ).encode(),
+    }
+
+
+def bench_fetch(latency, failures):
+    # End-to-end download of every source against a local replay server with
+    # injected latency, sequentially and with data.prefetch
+    from pathlib import Path
+
+    import cache
+    import fetch
+    from replay_server import ReplayServer
+
+    bodies = synthetic_upstream()
+    sources = [
+        ("provinces", config.PROVINCE_DATA_URL, config.parse_province_data),
+        ("cases", data.CASE_DATA_URL, data.parse_case_data),
+        ("vaccines", data.VACCINE_DATA_URL, data.parse_vaccine_history),
+    ]
+    paths = {
+        "/other": latency,
+        "/src/data/covidLive/covid19-download.csv": latency,
+        "/timeseries": latency,
+    }
+
+    def run(label, download_all, failing=None):
+        with tempfile.TemporaryDirectory() as tmp, ReplayServer(
+            bodies=bodies, latency=paths, failures=failing
+        ) as server:
+            cache.CACHE_DIR = Path(tmp)
+            fetch.UPSTREAM = server.url
+            start = time.perf_counter()
+            download_all()
+            elapsed = time.perf_counter() - start
+            print(f"{label:<40} {elapsed:6.2f} s  {len(server.requests)} requests")
+
+    as_of_date = datetime.date.today()
+    run(
+        "sequential",
+        lambda: [cache.refresh(s, url, as_of_date, p) for s, url, p in sources],
+    )
+    run("concurrent (prefetch)", lambda: data.prefetch(as_of_date))
+    run(
+        f"concurrent, {failures} failures per source",
+        lambda: data.prefetch(as_of_date),
+        failing={path: failures for path in paths},
+    )
+
+
+def suite_cases(cases, vaccines, population):
+    # (name, callable) pairs timed by the suite, all on in-memory frames
+    import event_study
+    import intervention_analysis
+
+    # Weekly reports for the second half of every province's history
+    late = cases["Date"] > cases["Date"].quantile(0.5)
+    gappy = cases[~late | (cases["Date"].dt.dayofweek == 0)]
+    merged = data.add_vaccinated(cases, vaccines)
+    immune = data.add_immunity(merged, population)
+    panel = data.calculate_R(immune, population)
+    province = Data("Saskatchewan", panel)
+    n_seconds = len(panel) // population.size
+    acceleration = pd.DataFrame(
+        {"Date": pd.date_range("2020-01-01", periods=n_seconds, freq="s")}
+    )
+    acceleration["Acceleration"] = np.sin(np.arange(n_seconds) / 50) / 10
+    return [
+        ("make_immunity_monotonic", lambda: make_immunity_monotonic(merged)),
+        ("resample_daily", lambda: data.resample_daily(gappy)),
+        ("add_vaccinated", lambda: data.add_vaccinated(cases, vaccines)),
+        ("add_immunity", lambda: data.add_immunity(merged, population)),
+        ("calculate_R", lambda: data.calculate_R(immune, population)),
+        (
+            "rolling_means",
+            lambda: data.rolling_means(panel, data.SMOOTHED_COLUMNS),
+        ),
+        ("smooth_data", lambda: intervention_analysis.smooth_data(province, 5)),
+        ("event_study", lambda: event_study.event_study(panel)),
+        (
+            "plot_R spec",
+            lambda: intervention_analysis.plot_R(province, 7).to_json(),
+        ),
+        ("integrate_a", lambda: intervention_analysis.integrate_a(acceleration)),
+    ]
+
+
+def git_commit():
+    # Of this checkout, wherever the benchmark is run from
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).parent,
+    )
+    return result.stdout.strip() or None
+
+
+def bench_suite(scales, repeat, output, compare):
+    # Times every pipeline stage at each (regions x history) scale. Results
+    # can be saved as JSON and compared against a previous run.
+    baseline = {}
+    if compare:
+        with open(compare) as f:
+            baseline = {(r["name"], r["scale"]): r for r in json.load(f)["results"]}
+
+    results = []
+    for scale in scales:
+        region_scale, history_scale = (int(x) for x in scale.split("x"))
+        cases, vaccines, population = synthetic_inputs(region_scale, history_scale)
+        for name, func in suite_cases(cases, vaccines, population):
+            result = {"name": name, "scale": scale, "rows": len(cases)}
+            try:
+                result["seconds"] = best_of(func, repeat)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            results.append(result)
+
+            line = f"{scale:>7} {name:<24}"
+            if "error" in result:
+                line += f" error: {result['error']}"
+            else:
+                line += f" {result['seconds'] * 1e3:10.2f} ms"
+                previous = baseline.get((name, scale), {}).get("seconds")
+                if previous:
+                    line += f"  ({result['seconds'] / previous:5.2f}x baseline)"
+            print(line)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "python": sys.version.split()[0],
+                    "pandas": pd.__version__,
+                    "numpy": np.__version__,
+                    "repeat": repeat,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the analysis code")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    suite = commands.add_parser(
+        "suite", help="Time every pipeline stage on scaled synthetic data"
+    )
+    suite.add_argument(
+        "--scales",
+        nargs="+",
+        default=["1x1", "10x1", "100x1", "1x10", "1x100"],
+        help="<regions>x<history> multiples of the real data set",
+    )
+    suite.add_argument("--repeat", type=int, default=3)
+    suite.add_argument("--output", help="Write the results to this JSON file")
+    suite.add_argument("--compare", help="JSON results of an earlier run")
+
+    monotonic = commands.add_parser(
+        "monotonic", help="make_immunity_monotonic against the original loop"
+    )
+    monotonic.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    monotonic.add_argument("--repeat", type=int, default=5)
+    monotonic.add_argument(
+        "--legacy-limit",
+        type=int,
+        default=100_000,
+        help="Largest size to also run (and compare against) the original loop",
+    )
+
+    imports = commands.add_parser("imports", help="Import cost of the app modules")
+    imports.add_argument(
+        "--modules",
+        nargs="+",
+        default=["config", "data", "intervention_analysis"],
+    )
+    imports.add_argument("--repeat", type=int, default=3)
+
+    ingest = commands.add_parser(
+        "ingest", help="Parse time and peak RSS of the case CSV ingestion"
+    )
+    ingest.add_argument("--scales", type=int, nargs="+", default=[10, 100])
+    ingest.add_argument("--chunksize", type=int, default=100_000)
+
+    memory = commands.add_parser(
+        "memory", help="Peak memory of the pipeline against a budget"
+    )
+    memory.add_argument("--regions", type=int, default=100)
+    memory.add_argument("--history", type=int, default=1)
+    memory.add_argument("--budget-mb", type=int, default=300)
+
+    charts = commands.add_parser(
+        "charts", help="Spec size of the chart builders against a byte budget"
+    )
+    charts.add_argument("--years", type=float, default=3)
+    charts.add_argument("--budget-kb", type=int, default=100)
+
+    fetching = commands.add_parser(
+        "fetch", help="Download every source from a local replay server"
+    )
+    fetching.add_argument("--latency", type=float, default=0.5)
+    fetching.add_argument("--failures", type=int, default=2)
+
+    measures = commands.add_parser(
+        "interventions", help="Intervention index load and query time"
+    )
+    measures.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    measures.add_argument("--repeat", type=int, default=5)
+
+    vintages = commands.add_parser(
+        "archive", help="Size and read time of the vintage archive"
+    )
+    vintages.add_argument("--vintages", type=int, default=90)
+    vintages.add_argument("--revisions", type=int, default=20)
+
+    ensemble = commands.add_parser(
+        "sir", help="SIR scenario ensemble projection sweep"
+    )
+    ensemble.add_argument("--scenarios", type=int, default=10_000)
+    ensemble.add_argument("--days", type=int, default=365)
+    ensemble.add_argument("--provinces", type=int, default=1)
+    ensemble.add_argument("--workers", type=int)
+    ensemble.add_argument("--repeat", type=int, default=3)
+
+    bands = commands.add_parser(
+        "uncertainty", help="Monte Carlo immunity and R(t) bands of every province"
+    )
+    bands.add_argument("--samples", type=int, default=10_000)
+    bands.add_argument("--estimator", choices=["SIR", "Renewal"], default="SIR")
+    bands.add_argument("--workers", type=int)
+    bands.add_argument("--repeat", type=int, default=3)
+
+    hierarchy = commands.add_parser(
+        "regions", help="Health-region pipeline with province and country roll-ups"
+    )
+    hierarchy.add_argument("--regions", type=int, default=120)
+    hierarchy.add_argument("--history", type=int, default=1)
+    hierarchy.add_argument("--budget-s", type=float, default=2.0)
+    hierarchy.add_argument("--repeat", type=int, default=3)
+
+    writer = commands.add_parser("_write")
+    writer.add_argument("path")
+    writer.add_argument("scale", type=int)
+
+    worker = commands.add_parser("_ingest")
+    worker.add_argument("path")
+    worker.add_argument("mode", choices=["legacy", "typed"])
+    worker.add_argument("chunksize", type=int)
+
+    args = parser.parse_args()
+    if args.command == "suite":
+        bench_suite(args.scales, args.repeat, args.output, args.compare)
+    elif args.command == "monotonic":
+        bench_immunity_monotonic(args.sizes, args.repeat, args.legacy_limit)
+    elif args.command == "imports":
+        bench_imports(args.modules, args.repeat)
+    elif args.command == "ingest":
+        bench_ingest(args.scales, args.chunksize)
+    elif args.command == "memory":
+        bench_memory(args.regions, args.history, args.budget_mb)
+    elif args.command == "charts":
+        bench_charts(args.years, args.budget_kb)
+    elif args.command == "fetch":
+        bench_fetch(args.latency, args.failures)
+    elif args.command == "interventions":
+        bench_interventions(args.sizes, args.repeat)
+    elif args.command == "archive":
+        bench_archive(args.vintages, args.revisions)
+    elif args.command == "sir":
+        bench_sir(args.scenarios, args.days, args.provinces, args.workers, args.repeat)
+    elif args.command == "uncertainty":
+        bench_uncertainty(args.samples, args.estimator, args.workers, args.repeat)
+    elif args.command == "regions":
+        bench_regions(args.regions, args.history, args.budget_s, args.repeat)
+    elif args.command == "_write":
+        print(write_synthetic_case_csv(args.path, args.scale))
+    elif args.command == "_ingest":
+        ingest_worker(args.path, args.mode, args.chunksize or None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import datetime
+import json
+import os
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+import fetch
+import instrument
+
+# Normalized upstream frames are kept on disk as Parquet, one file per source
+# and as_of_date, next to a small meta.json holding the HTTP validators of the
+# last successful download.
+CACHE_DIR = Path(
+    os.environ.get("COVID_CACHE_DIR", Path.home() / ".cache" / "covid19-analyses")
+)
+
+# Serve the last good snapshot without touching the network
+OFFLINE = os.environ.get("COVID_OFFLINE", "") not in ("", "0")
+
+# Sources whose snapshots are kept as an archive of vintages (see archive.py)
+# rather than one full Parquet copy per day
+ARCHIVED = {"cases", "vaccines"}
+
+
+def snapshot_path(source, as_of_date):
+    return CACHE_DIR / source / f"{as_of_date}.parquet"
+
+
+def source_archive(source):
+    # Imported here so that pyarrow is only loaded when an archive is used
+    from archive import Archive
+
+    return Archive(CACHE_DIR / source / "vintages")
+
+
+def has_snapshot(source, as_of_date):
+    if snapshot_path(source, as_of_date).exists():
+        return True
+    return source in ARCHIVED and str(as_of_date) in source_archive(source).files()
+
+
+def temporary_path(path):
+    # A file to write `path` to before moving it into place, unique so that
+    # sessions refreshing one source at once do not move each other's
+    return path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+
+
+def read_meta(source):
+    path = CACHE_DIR / source / "meta.json"
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_meta(source, meta):
+    path = CACHE_DIR / source / "meta.json"
+    tmp = temporary_path(path)
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+
+
+def read_snapshot(source, as_of_date):
+    path = snapshot_path(source, as_of_date)
+    if source in ARCHIVED and not path.exists():
+        return source_archive(source).read(as_of_date)
+    return pd.read_parquet(path)
+
+
+def write_snapshot(source, as_of_date, df):
+    if source in ARCHIVED:
+        source_archive(source).write(as_of_date, df)
+        return
+    path = snapshot_path(source, as_of_date)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = temporary_path(path)
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def snapshot_dates(source):
+    dates = {path.stem for path in (CACHE_DIR / source).glob("*.parquet")}
+    if source in ARCHIVED:
+        dates.update(source_archive(source).vintages())
+    return sorted(dates)
+
+
+def last_good_snapshot(source):
+    meta = read_meta(source)
+    if "as_of_date" not in meta:
+        raise FileNotFoundError(f"No cached snapshot for {source}")
+    return read_snapshot(source, meta["as_of_date"])
+
+
+def refresh(source, url, as_of_date, parse):
+    """Make sure a snapshot of `source` for `as_of_date` is on disk.
+
+    `parse` turns the raw response body (a binary file object) into a
+    DataFrame. Nothing is downloaded when the snapshot already exists or in
+    offline mode, and the download is revalidated with ETag/Last-Modified
+    otherwise. Upstream only serves its latest data, so nothing is
+    downloaded for an as_of_date in the past either. Returns the frame if it
+    was written, else None.
+    """
+    past = str(as_of_date) < str(datetime.date.today())
+    if has_snapshot(source, as_of_date) or OFFLINE or past:
+        return None
+
+    meta = read_meta(source)
+    headers = {}
+    if "etag" in meta:
+        headers["If-None-Match"] = meta["etag"]
+    if "last_modified" in meta:
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        resp, body = fetch.download(source, url, headers)
+    except requests.RequestException:
+        # Upstream is unreachable, callers fall back to whatever we had last
+        if "as_of_date" in meta:
+            return None
+        raise
+
+    with body:
+        if resp.status_code == 304:
+            df = read_snapshot(source, meta["as_of_date"])
+        else:
+            with instrument.stage(f"parse:{source}"):
+                df = parse(body)
+            meta["etag"] = resp.headers.get("ETag")
+            meta["last_modified"] = resp.headers.get("Last-Modified")
+            meta = {k: v for k, v in meta.items() if v is not None}
+
+    write_snapshot(source, as_of_date, df)
+    meta["as_of_date"] = str(as_of_date)
+    write_meta(source, meta)
+    return df
+
+
+def cached_frame(source, url, as_of_date, parse):
+    # The frame for `source` as of `as_of_date`: for a past date, the latest
+    # snapshot taken on or before it; for today, the last good snapshot when
+    # upstream could not be reached
+    df = refresh(source, url, as_of_date, parse)
+    if df is not None:
+        return df
+    if has_snapshot(source, as_of_date):
+        return read_snapshot(source, as_of_date)
+    if str(as_of_date) < str(datetime.date.today()):
+        dates = [date for date in snapshot_dates(source) if date <= str(as_of_date)]
+        if not dates:
+            raise FileNotFoundError(f"No snapshot of {source} as of {as_of_date}")
+        return read_snapshot(source, dates[-1])
+    return last_good_snapshot(source)
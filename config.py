@@ -1,14 +1,30 @@
 from pandas import DataFrame, to_datetime, read_csv, read_json
+from functools import lru_cache
 from pathlib import Path
-import requests
 import datetime
+import json
+import os
+import numpy as np
 # import streamlit as st
 
 
+PROVINCE_DATA_URL = 'https://api.opencovid.ca/other?loc=prov&stat=prov'
+BUNDLED_PROVINCE_DATA = Path(__file__).parent / 'province_data.csv'
+# Dated measures per province (abbr, Date, Measure, Type), edited by hand
+INTERVENTIONS_FILE = Path(
+    os.environ.get('COVID_INTERVENTIONS', Path(__file__).parent / 'interventions.csv')
+)
+
+
 def get_province_data(as_of_date):
-    data_url = 'https://api.opencovid.ca/other?loc=prov&stat=prov'
-    resp = requests.get(data_url)
-    df = DataFrame(resp.json()['prov'])
+    import fetch
+    resp, body = fetch.download('provinces', PROVINCE_DATA_URL)
+    with body:
+        return parse_province_data(body)
+
+
+def parse_province_data(body):
+    df = DataFrame(json.load(body)['prov'])
     df.rename(columns={
         'province_full': 'name',
         'province_short': 'abbr',
@@ -17,66 +33,93 @@ def get_province_data(as_of_date):
     return df
 
 
-province_data = get_province_data(datetime.datetime.today().date())
-
-interventions = {
-            'SK': [
-                {'Date': to_datetime('03-13-2020'), 'Measure': 'First restrictions, gathering size > 250', 'Type': 'Tighten'},
-                {'Date': to_datetime('03-18-2020'), 'Measure': 'State of Emergency', 'Type': 'Notice'},
-                {'Date': to_datetime('03-26-2020'), 'Measure': 'Gatherings limited to 10', 'Type': 'Tighten'},
-                {'Date': to_datetime('09-02-2020'), 'Measure': 'School Starts', 'Type': 'Event'},
-                {'Date': to_datetime('05-04-2020'), 'Measure': 'Medical clinics reopen / Campsites', 'Type': 'Ease'},
-                {'Date': to_datetime('05-19-2020'), 'Measure': 'Personal Care', 'Type': 'Ease'},
-                {'Date': to_datetime('06-08-2020'), 'Measure': 'Gathering size increase, beaches, playgrounds, fitness, child care open', 'Type': 'Ease'},
-                {'Date': to_datetime('06-22-2020'), 'Measure': 'Outdoor Rec, Gathings up to 30, outdoor sports allowed', 'Type': 'Ease'},
-                {'Date': to_datetime('07-06-2020'), 'Measure': 'Bars, Restaraunts, Casinos, Bingo, Indoor Rec Open', 'Type': 'Ease'},
-                {'Date': to_datetime('10-12-2020'), 'Measure': 'Thanksgiving', 'Type': 'Event'},
-                {'Date': to_datetime('11-03-2020'), 'Measure': 'Local Mask Policy (Regina, PA, Saskatoon)', 'Type': 'Tighten'},
-                {'Date': to_datetime('11-19-2020'), 'Measure': 'Province-wide Mask Policy', 'Type': 'Tighten'},
-                {'Date': to_datetime('11-27-2020'), 'Measure': 'Indoor gatherings capacity restrictions, group and teams sports cancelled', 'Type': 'Tighten'},
-                {'Date': to_datetime('12-14-2020'), 'Measure': 'Social gather restrictions, capacity restrictions for retailers', 'Type': 'Tighten'},
-                {'Date': to_datetime('03-09-2021'), 'Measure': 'Loosening of Social gather restrictions, capacity restrictions for retailers', 'Type': 'Ease'},
-                {'Date': to_datetime('03-23-2021'), 'Measure': 'Regina "lockdown"', 'Type': 'Tighten'}
-            ],
-            'QC': [
-                {'Date': to_datetime('12-25-2020'), 'Measure': 'Province wide lockdown', 'Type': 'Tighten'},
-                {'Date': to_datetime('01-09-2021'), 'Measure': 'Province wide curfew', 'Type': 'Tighten'}
-            ],
-            'PE': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'NS': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'NB': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'ON': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'MB': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'AB': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'BC': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'YT': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'NT': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'NU': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ],
-            'NL': [
-                {'Date': to_datetime('03-01-2020'), 'Measure': '', 'Type': ''}
-            ]
-
-        }
+@lru_cache(maxsize=1)
+def load_province_data():
+    # Today's metadata from the disk cache (downloading it if needed), or the
+    # bundled copy if neither the cache nor the network is available
+    try:
+        import cache
+        return cache.cached_frame(
+            'provinces', PROVINCE_DATA_URL, datetime.date.today(), parse_province_data
+        )
+    except Exception:
+        return read_csv(BUNDLED_PROVINCE_DATA)
+
+
+@lru_cache(maxsize=1)
+def province_index():
+    # Row of every province in province_data, by name and by abbreviation
+    df = load_province_data()
+    index = dict(zip(df['abbr'], range(len(df))))
+    index.update(zip(df['name'], range(len(df))))
+    return index
+
+
+class InterventionIndex():
+    # Interventions sorted by province and date, with each province's row
+    # range, so a date-range query is two binary searches within that range
+
+    def __init__(self, df):
+        df = df.sort_values(['abbr', 'Date'], kind='stable').reset_index(drop=True)
+        self.frame = df
+        self.dates = df['Date'].to_numpy()
+        abbrs = df['abbr'].astype(str).to_numpy()
+        starts = np.flatnonzero(np.r_[True, abbrs[1:] != abbrs[:-1]])[:len(df)]
+        ends = np.r_[starts[1:], len(df)]
+        self.ranges = {abbrs[lo]: (lo, hi) for lo, hi in zip(starts, ends)}
+
+    def query(self, abbr, start=None, end=None):
+        # Rows of `abbr` dated within [start, end]
+        lo, hi = self.ranges.get(abbr, (0, 0))
+        if start is not None:
+            lo += self.dates[lo:hi].searchsorted(to_datetime(start).to_datetime64())
+        if end is not None:
+            end = to_datetime(end).to_datetime64()
+            hi = lo + self.dates[lo:hi].searchsorted(end, side='right')
+        return self.frame.iloc[lo:hi]
+
+
+def read_interventions(path=INTERVENTIONS_FILE):
+    return read_csv(
+        path,
+        parse_dates=['Date'],
+        dtype={'abbr': 'category', 'Measure': 'str', 'Type': 'category'},
+        keep_default_na=False,
+    )
+
+
+_intervention_index = (None, None)
+
+
+def intervention_index():
+    # The index of INTERVENTIONS_FILE, rebuilt whenever the file changes
+    global _intervention_index
+    stat = os.stat(INTERVENTIONS_FILE)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if _intervention_index[0] != version:
+        _intervention_index = (version, InterventionIndex(read_interventions()))
+    return _intervention_index[1]
+
+
+def intervention_version():
+    # (mtime, size) of the INTERVENTIONS_FILE the current index was built from,
+    # for keying anything derived from the interventions
+    intervention_index()
+    return _intervention_index[0]
+
+
+def load_interventions():
+    return intervention_index().frame
+
+
+def __getattr__(name):
+    # province_data and interventions are only loaded on first access
+    if name == 'province_data':
+        return load_province_data()
+    if name == 'interventions':
+        return load_interventions()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 class Province():
 
@@ -85,12 +128,14 @@ class Province():
         self.name = self.data['name'].values[0]
         self.abbr = self.data['abbr'].values[0]
         self.population = self.data['population'].values[0]
-        self.interventions = self.__get_interventions()
 
-    def __get_interventions(self):
-        if self.abbr in interventions:
-            return DataFrame(interventions.get(self.abbr)).sort_values(['Date'])
+    @property
+    def interventions(self):
+        return self.interventions_between()
+
+    def interventions_between(self, start=None, end=None):
+        return intervention_index().query(self.abbr, start, end).drop(columns='abbr')
 
     def __get_province_data(self, province):
-        df = province_data.query(f"(name=='{province}') or (abbr=='{province}')")
-        return df
+        row = province_index()[province]
+        return load_province_data().iloc[row:row + 1]
@@ -1,112 +1,542 @@
+import cache
 import config
+import instrument
 import datetime
-import streamlit as st
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 import requests
-from numpy import nan
+from pandas.api.types import union_categoricals
 
 
-def make_immunity_monotonic(data):
-    while not data["Total Vaccinated"].is_monotonic:
-        data.loc[data["Date"] < pd.to_datetime("Jan 5, 2021"), "Total Vaccinated"] = 0
-        data["vacc_diff"] = data["Total Vaccinated"].diff()
-        data.loc[data["vacc_diff"] <= 0, "Total Vaccinated"] = nan
-        data["Total Vaccinated"] = (
-            data["Total Vaccinated"].ffill().fillna(0).astype(int)
+VACCINE_START_DATE = pd.to_datetime("Jan 5, 2021")
+
+# The panel functions below treat each distinct value of their `key` column as
+# one series: a province by default, or a health region (see regions.py)
+
+
+def monotonic_vaccinated(data, floor=None, key="Province"):
+    # Running maximum of Total Vaccinated within each province (in row order),
+    # with everything before the vaccine rollout zeroed. This is the fixed
+    # point of repeatedly dropping non-increasing points and forward filling,
+    # computed in one pass over every province at once: each province's values
+    # are lifted by a per-province offset so a single maximum.accumulate over
+    # the stacked provinces never carries across a province boundary.
+    # `floor` optionally maps provinces to the running maximum carried in from
+    # rows that are not part of `data`.
+    codes, _ = pd.factorize(data[key])
+    vaccinated = data["Total Vaccinated"].fillna(0).to_numpy(dtype="int64")
+    vaccinated = np.where(data["Date"].to_numpy() < VACCINE_START_DATE, 0, vaccinated)
+    if len(vaccinated) == 0:
+        return vaccinated
+
+    order = np.argsort(codes, kind="stable")
+    low = vaccinated.min()
+    span = vaccinated.max() - low + 1
+    offset = codes[order].astype("int64") * span
+    monotonic = np.empty_like(vaccinated)
+    monotonic[order] = (
+        np.maximum.accumulate(vaccinated[order] - low + offset) - offset + low
+    )
+    if floor is not None:
+        carried = np.nan_to_num(province_values(data, floor, key)).astype("int64")
+        monotonic = np.maximum(monotonic, carried)
+    return monotonic
+
+
+def make_immunity_monotonic(data, floor=None, key="Province"):
+    vaccinated = monotonic_vaccinated(data, floor, key)
+    return data.assign(**{"Total Vaccinated": vaccinated})
+
+
+def province_values(df, mapping, key="Province"):
+    # `mapping` (a Series or dict keyed by province name) looked up for every
+    # row, as a float array with NaN for provinces it does not have. Only the
+    # distinct provinces are looked up.
+    codes, provinces = pd.factorize(df[key])
+    values = pd.Series(provinces.astype(str)).map(mapping)
+    return np.append(values.to_numpy(dtype="float64"), np.nan)[codes]
+
+
+def population_of(df, population, key="Province"):
+    return province_values(df, population, key)
+
+
+@instrument.timed()
+def add_vaccinated(cases, vaccines, key="Province"):
+    # The one copy of the case rows that the later stages add their columns to.
+    # Vaccine keys take the case dtype so a categorical key survives the merge.
+    vaccines = vaccines[["Date", key, "New Vaccinated", "Total Vaccinated"]]
+    if isinstance(cases[key].dtype, pd.CategoricalDtype):
+        vaccines = vaccines.astype({key: cases[key].dtype})
+    df = cases.merge(vaccines, on=["Date", key], how="left")
+    df["Total Vaccinated"] = df["Total Vaccinated"].fillna(0).astype("int32")
+    df["New Vaccinated"] = df["New Vaccinated"].fillna(0).astype("int32")
+    return df
+
+
+@instrument.timed()
+def add_immunity(df, population, vaccinated_floor=None, key="Province"):
+    # Adds its columns to `df` in place
+    vaccinated = monotonic_vaccinated(df, vaccinated_floor, key)
+    df["Total Vaccinated"] = vaccinated.astype("int32")
+    pop = population_of(df, population, key)
+    cases = df["Total Cases"].to_numpy(dtype="float64")
+    df["Immunity (Lower Bound)"] = ((cases + vaccinated) / pop).astype("float32")
+    df["Immunity (Upper Bound)"] = ((cases * 5 + vaccinated) / pop).astype("float32")
+    return df
+
+
+def sir_compartments(df, population):
+    # S, I and R as fractions of each province's population
+    pop = population_of(df, population)
+    return pd.DataFrame(
+        {
+            "S": (pop - df["Total Cases"]) / pop,
+            "I": df["Active Cases"] / pop,
+            "R": (df["Total Recovered"] + df["Total Deaths"]) / pop,
+        },
+        index=df.index,
+    )
+
+
+def sorted_by_province(df, key="Province"):
+    # Rows in (key, Date) order with a fresh index; no copy if they are
+    # already
+    keys = pd.MultiIndex.from_arrays([df[key], df["Date"]])
+    if keys.is_monotonic_increasing and df.index.equals(pd.RangeIndex(len(df))):
+        return df
+    return df.sort_values([key, "Date"], kind="stable").reset_index(drop=True)
+
+
+@instrument.timed()
+def calculate_R(df, population, key="Province"):
+    # Central difference of the SIR compartments. Rows are sorted by province
+    # and date so the neighbouring days of every row are the rows next to it,
+    # unless they belong to another province.
+    df = sorted_by_province(df, key)
+    pop = population_of(df, population, key)
+    S = 1 - df["Total Cases"].to_numpy(dtype="float64") / pop
+    I = df["Active Cases"].to_numpy(dtype="float64") / pop
+    codes, _ = pd.factorize(df[key])
+    inside = np.zeros(len(df), dtype=bool)
+    inside[1:-1] = (codes[:-2] == codes[1:-1]) & (codes[2:] == codes[1:-1])
+
+    R = np.full(len(df), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dI = I[2:] - I[:-2]
+        dS = S[2:] - S[:-2]
+        R[1:-1] = 1 / ((dI / dS + 1) * S[1:-1])
+    R[~inside] = np.nan
+    df["R(t)"] = np.clip(R, 0, 10).astype("float32")
+    return df
+
+
+# Daily counts and the running totals they add up to
+DAILY_TOTALS = {
+    "New Cases": "Total Cases",
+    "New Deaths": "Total Deaths",
+    "New Recovered": "Total Recovered",
+}
+
+
+@instrument.timed()
+def resample_daily(cases, key="Province"):
+    """Place every province's case rows on a regular daily grid.
+
+    Each province gets one row per day from its first report to its last.
+    Totals on days without a report are interpolated between the reports on
+    either side and rounded down, so the increase over a gap is spread over
+    its days in whole counts; Active Cases is interpolated and rounded. Daily
+    counts are the differences of the totals, except on reported days that
+    follow a reported day, which keep the reported value. The "Reported"
+    column marks the rows that came from the feed. Frames that are already
+    daily pass through unchanged apart from that column.
+    """
+    cases = sorted_by_province(cases, key)
+    if "Reported" in cases:
+        reported = cases["Reported"].to_numpy(dtype=bool)
+    else:
+        reported = np.ones(len(cases), dtype=bool)
+    codes, _ = pd.factorize(cases[key])
+    day = ((cases["Date"] - cases["Date"].min()) // pd.Timedelta(days=1)).to_numpy()
+    starts = np.flatnonzero(np.diff(codes, prepend=-1) != 0)
+    ends = np.append(starts[1:], len(cases))
+    span = day[ends - 1] - day[starts] + 1 if len(cases) else np.array([], int)
+    n = int(span.sum())
+    if n == len(cases):
+        return cases.assign(Reported=reported)
+
+    # Grid row of every report, and the rows of the reports before and after
+    # every grid row. Each province's first and last rows are reports, so
+    # neither search leaves the province.
+    offsets = np.append(0, np.cumsum(span)[:-1])
+    position = (offsets - day[starts])[codes] + day
+    row = np.arange(n)
+    is_report = np.zeros(n, dtype=bool)
+    is_report[position] = True
+    report_of = np.full(n, -1)
+    report_of[position] = np.arange(len(cases))
+    before = np.maximum.accumulate(np.where(is_report, row, 0))
+    after = np.minimum.accumulate(np.where(is_report, row, n)[::-1])[::-1]
+    weight = (row - before) / np.maximum(after - before, 1)
+    before, after = report_of[before], report_of[after]
+
+    # Daily counts are taken as reported only right after another report
+    follows_report = is_report.copy()
+    follows_report[1:] &= is_report[:-1]
+    follows_report[offsets] = True
+    follows_report &= is_report
+
+    columns = {}
+    for col in cases.columns:
+        values = cases[col]
+        if col in DAILY_TOTALS.values() or col == "Active Cases":
+            lo = values.to_numpy(dtype="float64")[before]
+            hi = values.to_numpy(dtype="float64")[after]
+            filled = lo + (hi - lo) * weight
+            filled = np.round(filled) if col == "Active Cases" else np.floor(filled)
+            columns[col] = filled.astype(values.dtype)
+        elif col == "Date":
+            days = (row - position[before]) * np.timedelta64(1, "D")
+            columns[col] = values.to_numpy()[before] + days
+        elif col not in DAILY_TOTALS:
+            # The key, and anything else, is carried from the previous report
+            columns[col] = values.take(before).reset_index(drop=True)
+    for col, total in DAILY_TOTALS.items():
+        if col in cases:
+            change = np.diff(columns[total].astype("int64"), prepend=0)
+            daily = np.where(follows_report, cases[col].to_numpy()[before], change)
+            columns[col] = daily.astype(cases[col].dtype)
+    columns["Reported"] = is_report & reported[before]
+    return pd.DataFrame(columns)
+
+
+def build_panel(cases, vaccines, population, vaccinated_floor=None, key="Province"):
+    df = add_vaccinated(resample_daily(cases, key), vaccines, key)
+    df = add_immunity(df, population, vaccinated_floor, key)
+    df = calculate_R(df, population, key)
+    return df
+
+
+SMOOTHING_WINDOWS = (3, 7, 14, 28)
+SMOOTHED_COLUMNS = ["R(t)", "New Cases", "Active Cases"]
+
+
+def grid_positions(df, key="Province"):
+    # Position of every row on a dense (province, day) grid, flattened so each
+    # province's days are contiguous. Returns the positions, the position of
+    # each row's province start, and the grid shape.
+    codes, _ = pd.factorize(df[key])
+    day = ((df["Date"] - df["Date"].min()) // pd.Timedelta(days=1)).to_numpy()
+    n_days = day.max() + 1
+    start = codes * n_days
+    return start + day, start, (codes.max() + 1, n_days)
+
+
+def prefix_sums(values):
+    # Prefix sums along the first axis of `values`, and of its non-NaN counts,
+    # each with a leading row of zeros, so the mean of rows lo to hi - 1 that
+    # have data is (sums[hi] - sums[lo]) / (counts[hi] - counts[lo]). Sums
+    # keep the dtype of `values`, whose NaNs are zeroed in place.
+    valid = ~np.isnan(values)
+    values[~valid] = 0
+    shape = (len(values) + 1,) + values.shape[1:]
+    sums = np.zeros(shape, dtype=values.dtype)
+    np.cumsum(values, axis=0, out=sums[1:])
+    counts = np.zeros(shape, dtype="int32")
+    np.cumsum(valid, axis=0, out=counts[1:])
+    return sums, counts
+
+
+def grid_prefix_sums(df, columns, key="Province"):
+    # prefix_sums of `columns` on the dense (province, day) grid of
+    # grid_positions, where missing days are NaN. Returns the sums, the
+    # counts, and the grid positions of the rows and of their provinces'
+    # starts, and the grid shape.
+    position, start, shape = grid_positions(df, key)
+    values = np.full((shape[0] * shape[1], len(columns)), np.nan)
+    values[position] = df[columns].to_numpy(dtype="float64")
+    sums, counts = prefix_sums(values)
+    return sums, counts, position, start, shape
+
+
+@instrument.timed()
+def rolling_means(df, columns, windows=SMOOTHING_WINDOWS, key="Province"):
+    # Trailing means of `columns` over each of `windows` days, for every
+    # province and window in one pass. Rows are placed on a regular daily grid
+    # per province (missing days and NaNs are skipped, as in a time-based
+    # rolling mean), so each mean is a difference of two prefix sums.
+    names = [f"{col} ({window}d)" for window in windows for col in columns]
+    if len(df) == 0:
+        return pd.DataFrame(columns=names, index=df.index, dtype="float32")
+
+    sums, counts, position, start, _ = grid_prefix_sums(df, columns, key)
+
+    # Sums are accumulated in float64; the means are stored as float32, one
+    # window at a time
+    hi = position + 1
+    means = np.empty((len(df), len(windows), len(columns)), dtype="float32")
+    for i, window in enumerate(windows):
+        lo = np.maximum(hi - window, start)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means[:, i] = (sums[hi] - sums[lo]) / (counts[hi] - counts[lo])
+    return pd.DataFrame(means.reshape(len(df), -1), columns=names, index=df.index)
+
+
+def first_changed_date(old, new):
+    # Earliest date with a row that was appended, revised or removed upstream
+    keys = ["Province", "Date"]
+    old = old.assign(Province=old["Province"].astype(str)).set_index(keys)
+    new = new.assign(Province=new["Province"].astype(str)).set_index(keys)
+    index = old.index.union(new.index)
+    old = old.reindex(index)
+    new = new.reindex(index, columns=old.columns)
+    changed = (old != new) & ~(old.isna() & new.isna())
+    dates = index.get_level_values("Date")[changed.any(axis=1).to_numpy()]
+    return dates.min() if len(dates) else None
+
+
+# R(t) is a central difference, so a changed day also changes the day before
+# it, and recomputing that day needs one more day of context.
+PANEL_LOOKBACK = pd.Timedelta(days=2)
+
+
+@instrument.timed()
+def update_panel(panel, cases, vaccines, population, since):
+    # Recompute only the rows from `since` onwards (plus the look-back) and
+    # splice them onto the rows of `panel` that cannot have changed
+    if since is None:
+        return panel
+    start = since - PANEL_LOOKBACK
+    keep = panel[panel["Date"] < since - pd.Timedelta(days=1)]
+    floor = keep.groupby(keep["Province"].astype(str))["Total Vaccinated"].max()
+    tail = build_panel(
+        cases[cases["Date"] >= start],
+        vaccines[vaccines["Date"] >= start],
+        population,
+        vaccinated_floor=floor,
+    )
+    tail = tail[tail["Date"] >= since - pd.Timedelta(days=1)]
+    df = pd.concat([keep, tail], ignore_index=True)
+    return df.sort_values(["Province", "Date"], kind="stable").reset_index(drop=True)
+
+
+# Panels are kept on disk under a versioned source name. Bumped whenever the
+# columns, dtypes or computation of build_panel change, so that neither a
+# cached panel nor the base of an incremental update comes from older code.
+PANEL_VERSION = 1
+PANEL_SOURCE = f"panel-v{PANEL_VERSION}"
+
+
+def previous_refresh(as_of_date):
+    # Latest earlier as_of_date whose panel and inputs are all on disk
+    dates = [
+        date
+        for date in cache.snapshot_dates(PANEL_SOURCE)
+        if date < str(as_of_date)
+        and cache.has_snapshot("cases", date)
+        and cache.has_snapshot("vaccines", date)
+    ]
+    return dates[-1] if dates else None
+
+
+@lru_cache(maxsize=4)
+@instrument.timed()
+def get_panel(as_of_date):
+    # Every province's derived series, computed once per as_of_date. When the
+    # disk cache holds the panel and inputs of an earlier refresh, only the
+    # tail that changed upstream since then is recomputed.
+    if cache.has_snapshot(PANEL_SOURCE, as_of_date):
+        return cache.read_snapshot(PANEL_SOURCE, as_of_date)
+
+    prefetch(as_of_date)
+    cases, _ = get_case_data(as_of_date)
+    vaccines, _ = get_vaccine_history(as_of_date)
+    population = config.province_data.set_index("name")["population"]
+
+    previous = previous_refresh(as_of_date)
+    if previous is None:
+        panel = build_panel(cases, vaccines, population)
+    else:
+        # Cases are compared on the daily grid, where a revised report also
+        # changes the interpolated days before it
+        cases = resample_daily(cases)
+        old_cases = resample_daily(cache.read_snapshot("cases", previous))
+        changed = [
+            first_changed_date(old_cases, cases),
+            first_changed_date(
+                normalize_provinces(cache.read_snapshot("vaccines", previous)),
+                vaccines,
+            ),
+        ]
+        changed = [date for date in changed if date is not None]
+        panel = update_panel(
+            cache.read_snapshot(PANEL_SOURCE, previous),
+            cases,
+            vaccines,
+            population,
+            min(changed) if changed else None,
         )
-    data = data.drop("vacc_diff", axis=1, errors="ignore")
-    return data
+    cache.write_snapshot(PANEL_SOURCE, as_of_date, panel)
+    return panel
+
+
+@lru_cache(maxsize=4)
+@instrument.timed()
+def get_smoothed(as_of_date):
+    # Rolling means for every province and smoothing window, aligned to the
+    # panel's rows
+    return rolling_means(get_panel(as_of_date), SMOOTHED_COLUMNS)
+
+
+@lru_cache(maxsize=4)
+@instrument.timed()
+def get_renewal(as_of_date):
+    # Renewal-equation R(t) with 95% intervals for every province and
+    # smoothing window, aligned to the panel's rows
+    from renewal import renewal_R
+
+    return renewal_R(get_panel(as_of_date))
+
+
+def province_ranges(df, key="Province"):
+    # Row range of each province in a frame sorted by province, so a
+    # province's rows are a slice (a view of the frame, not a copy)
+    codes, provinces = pd.factorize(df[key])
+    starts = np.flatnonzero(np.diff(codes, prepend=-1) != 0)
+    ends = np.append(starts[1:], len(df))
+    return {str(provinces[codes[lo]]): (lo, hi) for lo, hi in zip(starts, ends)}
+
+
+@lru_cache(maxsize=4)
+def get_province_ranges(as_of_date):
+    return province_ranges(get_panel(as_of_date))
+
+
+def memory_report(frames):
+    # Rows, columns and deep memory of each named frame
+    return pd.DataFrame(
+        [
+            {
+                "Stage": name,
+                "Rows": len(df),
+                "Columns": df.shape[1],
+                "MB": round(df.memory_usage(deep=True).sum() / 2**20, 3),
+            }
+            for name, df in frames.items()
+        ]
+    ).set_index("Stage")
 
 
 class Data:
-    def __init__(self, province):
-        self.as_of_date = datetime.datetime.today().date()
+    # .data, .smoothed and .renewal are this province's slice of the shared
+    # panel-wide frames; they are read-only, so none of them is copied
+    @instrument.timed("Data")
+    def __init__(self, province, panel=None, as_of_date=None):
+        self.as_of_date = as_of_date or datetime.datetime.today().date()
         self.province = config.Province(province)
-        df, _ = get_case_data(self.as_of_date)
-        self.data = df.query(f'Province=="{self.province.name}"')
-        self.__add_vaccinated()
-        self.__add_immunity()
-        self.__calculate_R()
-
-    def __add_vaccinated(self):
-        df = self.data.copy()
-        vaccine_data, date = get_vaccine_history(self.as_of_date)
-        df = df.merge(vaccine_data, on=["Date", "Province"], how="left")
-        df["Total Vaccinated"] = df["Total Vaccinated"].fillna(0).astype(int)
-        df["New Vaccinated"] = df["New Vaccinated"].fillna(0).astype(int)
-        self.data = df
-        return self
-
-    def __add_immunity(self):
-        df = self.data.copy()
-        df = df.groupby(["Province"]).apply(make_immunity_monotonic)
-        df["Immunity (Lower Bound)"] = (
-            df["Total Cases"] + df["Total Vaccinated"]
-        ) / self.province.population
-        df["Immunity (Upper Bound)"] = (
-            df["Total Cases"] * 5 + df["Total Vaccinated"]
-        ) / self.province.population
-        self.data = df
-        return self
-
-    def __calculate_R(self):
-        df = self.data.sort_values(["Date"]).copy()
-        df["S"] = self.province.population - df["Total Cases"]
-        df["I"] = df["Active Cases"]
-        df["R"] = df["Total Recovered"] + df["Total Deaths"]
-
-        df[["S", "I", "R"]] = df[["S", "I", "R"]] / self.province.population
-
-        R = df["I"].shift(-1) - df["I"].shift(1)
-        R /= df["S"].shift(-1) - df["S"].shift(1)
-        R += 1
-        R *= df["S"]
-        R = 1 / R
-        R = R.clip(upper=10, lower=0)
-        df["R(t)"] = R
-        df = df.drop(["I", "S", "R"], 1)
-        self.data = df
-        return self
-
-
-@st.cache(allow_output_mutation=True)
-def get_case_data(as_of_date):
-    data_url = (
-        "https://health-infobase.canada.ca/src/data/covidLive/covid19-download.csv"
+        # The column and value identifying this series in the panel
+        self.key, self.name = "Province", self.province.name
+        self.population = self.province.population
+        if panel is None:
+            ranges = get_province_ranges(self.as_of_date)
+            rows = slice(*ranges.get(self.province.name, (0, 0)))
+            self.data = get_panel(self.as_of_date).iloc[rows]
+            self.smoothed = get_smoothed(self.as_of_date).iloc[rows]
+            self.renewal = get_renewal(self.as_of_date).iloc[rows]
+        else:
+            from renewal import renewal_R
+
+            panel = sorted_by_province(panel)
+            rows = slice(*province_ranges(panel).get(self.province.name, (0, 0)))
+            self.data = panel.iloc[rows]
+            self.smoothed = rolling_means(self.data, SMOOTHED_COLUMNS)
+            self.renewal = renewal_R(self.data)
+
+    def memory_report(self):
+        return memory_report(
+            {"data": self.data, "smoothed": self.smoothed, "renewal": self.renewal}
+        )
+
+
+def vintage_R(province, vintages, window=7):
+    # Smoothed R(t) of `province` as estimated from the data of each vintage
+    # (as_of_date), one column per vintage, to see how the estimate for a
+    # date was revised as later data came in
+    column = f"R(t) ({window}d)"
+    estimates = {}
+    for vintage in vintages:
+        data = Data(province, as_of_date=vintage)
+        estimates[str(vintage)] = data.smoothed[column].set_axis(data.data["Date"])
+    return pd.DataFrame(estimates)
+
+
+CASE_DATA_URL = (
+    "https://health-infobase.canada.ca/src/data/covidLive/covid19-download.csv"
+)
+VACCINE_DATA_URL = (
+    "https://api.opencovid.ca/timeseries?stat=avaccine&loc=prov&ymd=true"
+)
+
+
+CASE_COLUMNS = {
+    "prname": "Province",
+    "date": "Date",
+    "numtoday": "New Cases",
+    "numrecover": "Total Recovered",
+    "numdeathstoday": "New Deaths",
+    "numtotal": "Total Cases",
+    "numdeaths": "Total Deaths",
+    "numrecoveredtoday": "New Recovered",
+    "numactive": "Active Cases",
+}
+CASE_CSV_CHUNKSIZE = 100_000
+CASE_COUNT_COLUMNS = [
+    col for col in CASE_COLUMNS.values() if col not in ["Province", "Date"]
+]
+
+
+def normalize_case_chunk(df):
+    df = df.rename(columns=CASE_COLUMNS)[list(CASE_COLUMNS.values())]
+    counts = df[CASE_COUNT_COLUMNS].fillna(0).astype("int32")
+    return pd.concat([df[["Province", "Date"]], counts], axis=1)
+
+
+def read_case_csv(source, chunksize=None):
+    # Only the columns we use are parsed, straight into their final types.
+    # Counts are read as floats (the feed has blanks) and narrowed per chunk,
+    # so with `chunksize` peak memory is one raw chunk plus the compact result.
+    reader = pd.read_csv(
+        source,
+        usecols=list(CASE_COLUMNS),
+        dtype={
+            "prname": "category",
+            **{col: "float64" for col in CASE_COLUMNS if col not in ["prname", "date"]},
+        },
+        parse_dates=["date"],
+        thousands=",",
+        engine="c",
+        chunksize=chunksize,
     )
-    df = pd.read_csv(data_url, parse_dates=["date"])
-    col_names = {
-        "prname": "Province",
-        "date": "Date",
-        "numtoday": "New Cases",
-        "numrecover": "Total Recovered",
-        "numdeathstoday": "New Deaths",
-        "numtotal": "Total Cases",
-        "numdeaths": "Total Deaths",
-        "numrecoveredtoday": "New Recovered",
-        "numactive": "Active Cases",
-    }
+    if chunksize is None:
+        return normalize_case_chunk(reader)
 
-    df.rename(columns=col_names, inplace=True)
-    df = df[col_names.values()]
-    int_cols = {
-        col: int for col in df.columns[~df.columns.isin(["Province", "Date"])].to_list()
-    }
-    for col in int_cols:
-        try:
-            df[col] = df[col].str.replace(",", "")
-        except:
-            pass
-    df = df.fillna(0)
-    df = df.astype(dtype=int_cols)
-    return df, as_of_date
+    chunks = [normalize_case_chunk(chunk) for chunk in reader]
+    provinces = union_categoricals([chunk["Province"] for chunk in chunks])
+    df = pd.concat([chunk.drop(columns="Province") for chunk in chunks])
+    df.insert(0, "Province", provinces)
+    return df.reset_index(drop=True)
 
 
-@st.cache(allow_output_mutation=True)
-def get_vaccine_history(as_of_date):
-    data_url = "https://api.opencovid.ca/timeseries?stat=avaccine&loc=prov&ymd=true"
-    resp = requests.get(data_url)
-    df = pd.DataFrame(resp.json()["avaccine"])
+def parse_case_data(body):
+    return read_case_csv(body, chunksize=CASE_CSV_CHUNKSIZE)
+
+
+def parse_vaccine_history(body):
+    df = pd.DataFrame(json.load(body)["avaccine"])
     df.rename(
         columns={
             "date_vaccine_administered": "Date",
@@ -117,9 +547,53 @@ def get_vaccine_history(as_of_date):
         inplace=True,
     )
     df["Date"] = pd.to_datetime(df["Date"])
-    # Normalize province names
+    return df
+
+
+def normalize_provinces(df):
+    # The vaccine feed uses abbreviations, the case feed full names. This is
+    # applied after loading so that downloading does not need province_data.
     prov_names = {
         abbr: name for abbr, name in config.province_data[["abbr", "name"]].values
     }
     df["Province"] = df["Province"].apply(lambda x: prov_names.get(x, x))
+    return df
+
+
+@instrument.timed()
+def prefetch(as_of_date):
+    # Download every upstream source concurrently, so a cold start waits for
+    # the slowest source instead of the sum of all three. Best effort: a
+    # source that cannot be downloaded is left to its loader, which falls
+    # back to a cached snapshot or the bundled province data, or raises
+    sources = [
+        ("provinces", config.PROVINCE_DATA_URL, config.parse_province_data),
+        ("cases", CASE_DATA_URL, parse_case_data),
+        ("vaccines", VACCINE_DATA_URL, parse_vaccine_history),
+    ]
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        futures = [
+            pool.submit(cache.refresh, source, url, as_of_date, parse)
+            for source, url, parse in sources
+        ]
+        for future in futures:
+            try:
+                future.result()
+            except requests.RequestException:
+                pass
+
+
+@lru_cache(maxsize=4)
+@instrument.timed()
+def get_case_data(as_of_date):
+    df = cache.cached_frame("cases", CASE_DATA_URL, as_of_date, parse_case_data)
     return df, as_of_date
+
+
+@lru_cache(maxsize=4)
+@instrument.timed()
+def get_vaccine_history(as_of_date):
+    df = cache.cached_frame(
+        "vaccines", VACCINE_DATA_URL, as_of_date, parse_vaccine_history
+    )
+    return normalize_provinces(df), as_of_date
@@ -0,0 +1,149 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrument
+from data import SMOOTHING_WINDOWS, get_panel, grid_prefix_sums
+
+# Days between an intervention and the start of its "after" window
+LAGS = np.arange(0, 43)
+EVENT_COLUMNS = ["R(t)", "New Cases"]
+
+
+def prefix_sums(panel, columns):
+    # Prefix sums of `columns` and of their non-missing counts over the dense
+    # (province, day) grid, with each province's grid start and length
+    sums, counts, _, start, (_, n_days) = grid_prefix_sums(panel, columns)
+    starts = pd.Series(start, index=panel["Province"].astype(str).to_numpy())
+    starts = starts[~starts.index.duplicated()]
+    return sums, counts, starts, n_days
+
+
+def province_events(interventions=None):
+    # Dated interventions with the full province name
+    if interventions is None:
+        interventions = config.interventions
+    names = config.province_data.set_index("abbr")["name"]
+    events = interventions.assign(
+        Province=interventions["abbr"].astype(str).map(names),
+        Type=interventions["Type"].astype(str),
+    )
+    return events.dropna(subset=["Province"]).reset_index(drop=True)
+
+
+@instrument.timed()
+def event_study(panel, interventions=None, lags=LAGS, windows=SMOOTHING_WINDOWS):
+    """Change in R(t) and new cases around every intervention.
+
+    For each intervention, lag and window length, the mean of each of
+    EVENT_COLUMNS over the `window` days before the intervention is compared
+    with its mean over the `window` days starting `lag` days after it. Every
+    mean is a difference of two prefix sums on the daily grid, so the whole
+    (intervention, lag, window) cube is computed at once. Missing days are
+    skipped; windows without any data are NaN.
+    """
+    events = province_events(interventions)
+    sums, counts, starts, n_days = prefix_sums(panel, EVENT_COLUMNS)
+    events = events[events["Province"].isin(starts.index)].reset_index(drop=True)
+    lags = np.asarray(lags)
+    windows = np.asarray(windows)
+
+    # Grid bounds of each event's province and the position of its date,
+    # broadcast to (event, lag, window)
+    first = starts[events["Province"]].to_numpy()[:, None, None]
+    last = first + n_days
+    day = (events["Date"] - panel["Date"].min()) // pd.Timedelta(days=1)
+    anchor = first + day.to_numpy()[:, None, None]
+    lag = lags[None, :, None]
+    window = windows[None, None, :]
+
+    def window_mean(lo, hi):
+        lo = np.clip(lo, first, last)
+        hi = np.clip(hi, first, last)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (sums[hi] - sums[lo]) / (counts[hi] - counts[lo])
+
+    after = window_mean(anchor + lag, anchor + lag + window)
+    before = np.broadcast_to(window_mean(anchor - window, anchor), after.shape)
+
+    index = np.indices(after.shape[:3]).reshape(3, -1)
+    study = events[["Province", "Date", "Measure", "Type"]].iloc[index[0]]
+    study = study.reset_index(drop=True).assign(
+        Lag=lags[index[1]], Window=windows[index[2]]
+    )
+    before = before.reshape(-1, len(EVENT_COLUMNS))
+    after = after.reshape(-1, len(EVENT_COLUMNS))
+    R, cases = EVENT_COLUMNS.index("R(t)"), EVENT_COLUMNS.index("New Cases")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        case_change = 100 * (after[:, cases] / before[:, cases] - 1)
+    case_change[~(before[:, cases] > 0)] = np.nan
+    return study.assign(
+        **{
+            "R(t) before": before[:, R],
+            "R(t) after": after[:, R],
+            "R(t) change": after[:, R] - before[:, R],
+            "New Cases before": before[:, cases],
+            "New Cases after": after[:, cases],
+            "New Cases change (%)": case_change,
+        }
+    )
+
+
+def summarize(study):
+    # Mean and median change by intervention Type, window and lag, over the
+    # interventions with data on both sides
+    return (
+        study.dropna(subset=["R(t) change"])
+        .groupby(["Type", "Window", "Lag"])
+        .agg(
+            **{
+                "Interventions": ("R(t) change", "size"),
+                "Mean R(t) change": ("R(t) change", "mean"),
+                "Median R(t) change": ("R(t) change", "median"),
+                "Median New Cases change (%)": ("New Cases change (%)", "median"),
+            }
+        )
+        .reset_index()
+    )
+
+
+def estimated_lags(summary):
+    # The lag with the largest mean change in R(t), by Type and window
+    by = [summary["Type"], summary["Window"]]
+    strongest = summary["Mean R(t) change"].abs().groupby(by).idxmax()
+    return summary.loc[strongest].reset_index(drop=True)
+
+
+def get_summary(as_of_date):
+    # Recomputed when the interventions file changes, since a reloaded index
+    # is a new cache key
+    return _summary(as_of_date, config.intervention_index())
+
+
+@lru_cache(maxsize=4)
+def _summary(as_of_date, index):
+    return summarize(event_study(get_panel(as_of_date), index.frame))
+
+
+@instrument.timed()
+def plot_lags(summary, window):
+    import altair as alt
+
+    # Lag x Type heatmap of the mean change in R(t) for one window length
+    df = summary[summary["Window"] == window].copy()
+    df["Mean R(t) change"] = df["Mean R(t) change"].round(3)
+    return (
+        alt.Chart(df)
+        .mark_rect()
+        .encode(
+            x=alt.X("Lag:O", title="Days after the intervention"),
+            y=alt.Y("Type:N", title="Intervention Type"),
+            color=alt.Color(
+                "Mean R(t) change:Q",
+                scale=alt.Scale(scheme="redblue", reverse=True, domainMid=0),
+            ),
+            tooltip=["Type", "Lag", "Mean R(t) change", "Interventions"],
+        )
+    )
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrument
+
+# (connect, read) timeouts in seconds per upstream source
+TIMEOUTS = {
+    "provinces": (3.05, 10),
+    "cases": (3.05, 60),
+    "vaccines": (3.05, 30),
+    "region_cases": (3.05, 60),
+    "region_deaths": (3.05, 60),
+}
+DEFAULT_TIMEOUT = (3.05, 30)
+
+RETRIES = 3
+BACKOFF = 0.5  # seconds, doubled after every failed attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Bodies larger than this are spooled to a temporary file while streaming
+SPOOL_SIZE = 8 * 2**20
+CHUNK_SIZE = 2**20
+
+# Send every request to this scheme://host[:port] instead (e.g. a local
+# replay server), keeping the path and query
+UPSTREAM = os.environ.get("COVID_UPSTREAM")
+
+_session = None
+
+
+def session():
+    # One pooled session shared by every source and thread
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+
+def resolve(url):
+    if not UPSTREAM:
+        return url
+    upstream = urlsplit(UPSTREAM)
+    parts = urlsplit(url)
+    return urlunsplit((upstream.scheme, upstream.netloc) + tuple(parts[2:]))
+
+
+def download(source, url, headers=None):
+    """GET `url`, streaming the body into a (spooled) temporary file.
+
+    Connection errors, timeouts, truncated bodies and retryable statuses are
+    retried up to RETRIES times with exponential backoff. Returns the response
+    and the body rewound to its start; a 304 has an empty body.
+    """
+    timeout = TIMEOUTS.get(source, DEFAULT_TIMEOUT)
+    for attempt in range(RETRIES + 1):
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        try:
+            with instrument.stage(f"download:{source}"), session().get(
+                resolve(url), headers=headers, timeout=timeout, stream=True
+            ) as resp:
+                if resp.status_code in RETRY_STATUSES and attempt < RETRIES:
+                    raise requests.HTTPError(response=resp)
+                resp.raise_for_status()
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    body.write(chunk)
+        except requests.RequestException as e:
+            body.close()
+            retryable = not isinstance(e, requests.HTTPError) or (
+                e.response is not None and e.response.status_code in RETRY_STATUSES
+            )
+            if attempt == RETRIES or not retryable:
+                raise
+            time.sleep(BACKOFF * 2**attempt)
+            continue
+        body.seek(0)
+        return resp, body
+
+
+def record(urls, directory):
+    # Save live responses for replay_server.ReplayServer
+    from replay_server import recording_path
+
+    for url in urls:
+        resp, body = download(None, url)
+        path = recording_path(directory, url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with body, open(path, "wb") as f:
+            shutil.copyfileobj(body, f)
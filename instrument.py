@@ -0,0 +1,102 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Stage timings are only collected when COVID_DIAGNOSTICS is set; otherwise
+# stage() hands back a shared no-op context manager and timed() calls straight
+# through. COVID_TRACE_MEMORY adds tracemalloc peaks, which does slow the
+# traced code down noticeably.
+ENABLED = os.environ.get("COVID_DIAGNOSTICS", "") not in ("", "0")
+TRACE_MEMORY = os.environ.get("COVID_TRACE_MEMORY", "") not in ("", "0")
+
+logger = logging.getLogger("covid.diagnostics")
+if ENABLED and not logger.handlers:
+    # One JSON object per line, to COVID_DIAGNOSTICS_LOG or stderr
+    path = os.environ.get("COVID_DIAGNOSTICS_LOG")
+    handler = logging.FileHandler(path) if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_NULL = nullcontext()
+# Streamlit runs every session's script on its own thread, so records are kept
+# per thread
+_local = threading.local()
+
+
+def records():
+    # Stages recorded on this thread since the last reset()
+    return list(getattr(_local, "records", []))
+
+
+def reset():
+    _local.records = []
+
+
+@contextmanager
+def _stage(name):
+    stack = _local.__dict__.setdefault("stack", [])
+    frame = {"peak": 0, "start": 0}
+    if TRACE_MEMORY:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        frame["start"] = frame["peak"] = current
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = {
+            "stage": name,
+            "seconds": round(time.perf_counter() - start, 6),
+            "depth": len(stack) - 1,
+            "thread": threading.current_thread().name,
+            "time": time.time(),
+        }
+        stack.pop()
+        if TRACE_MEMORY:
+            # Peaks of inner stages are folded into the enclosing one, since
+            # every stage resets tracemalloc's peak when it starts
+            _, peak = tracemalloc.get_traced_memory()
+            frame["peak"] = max(frame["peak"], peak)
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], frame["peak"])
+            tracemalloc.reset_peak()
+            record["peak_kb"] = round((frame["peak"] - frame["start"]) / 1024, 1)
+        _local.__dict__.setdefault("records", []).append(record)
+        logger.info(json.dumps(record))
+
+
+def stage(name):
+    """Context manager timing the enclosed block as `name`."""
+    if not ENABLED:
+        return _NULL
+    return _stage(name)
+
+
+def timed(name=None):
+    """Decorator timing every call of the function as `name`."""
+
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with _stage(label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,36 +1,143 @@
 import config
+import instrument
+import numpy as np
 import pandas as pd
 import datetime
-import streamlit as st
-import altair as alt
-from data import Data
-from numpy import nan
-from scipy.integrate import cumtrapz
-from streamlit import config as st_config
-
-
-def smooth_data(df, window):
-    df["R(t) (smoothed)"] = (
-        df.set_index("Date")["R(t)"].rolling(f"{window}d").mean().values
-    )
-    df["New Cases (smoothed)"] = (
-        df.set_index("Date")["New Cases"].rolling(f"{window}d").mean().values
-    )
-    df["Active Cases (smoothed)"] = (
-        df.set_index("Date")["Active Cases"].rolling(f"{window}s").mean().values
+from data import SMOOTHED_COLUMNS, SMOOTHING_WINDOWS, Data, rolling_means
+from event_study import estimated_lags, get_summary, plot_lags
+import memo
+import regions
+from renewal import renewal_R
+import uncertainty
+
+# altair, scipy and streamlit are imported where they are used so that
+# importing this module (e.g. from a batch job or a benchmark) stays cheap
+
+
+# R(t) estimators selectable in the app: the SIR finite difference from
+# data.calculate_R, or the renewal-equation estimate from renewal.py
+ESTIMATORS = ["SIR", "Renewal"]
+
+
+def smooth_data(data, window, estimator="SIR"):
+    # The `window`-day means come precomputed with the Data object, so this
+    # only selects columns; data.data itself is left untouched. With the
+    # renewal estimator, "R(t) (smoothed)" is the renewal estimate over the
+    # same window and "R(t) lower"/"R(t) upper" its 95% interval.
+    columns = [f"{col} ({window}d)" for col in SMOOTHED_COLUMNS]
+    if set(columns).issubset(data.smoothed.columns):
+        smoothed = data.smoothed[columns]
+    else:
+        smoothed = rolling_means(data.data, SMOOTHED_COLUMNS, [window])
+    smoothed = smoothed.set_axis(
+        [f"{col} (smoothed)" for col in SMOOTHED_COLUMNS], axis=1
+    )
+
+    if estimator == "Renewal":
+        columns = [
+            f"R(t) renewal{bound} ({window}d)" for bound in ["", " lower", " upper"]
+        ]
+        if set(columns).issubset(data.renewal.columns):
+            renewal = data.renewal[columns]
+        else:
+            renewal = renewal_R(data.data, [window])
+        renewal = renewal.set_axis(
+            ["R(t) (smoothed)", "R(t) lower", "R(t) upper"], axis=1
+        )
+        smoothed = smoothed.drop(columns="R(t) (smoothed)").join(renewal)
+    return data.data.join(smoothed)
+
+
+# Upper bound on the number of points a time series contributes to a chart spec
+MAX_CHART_POINTS = 500
+
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: indices of `n_out` points of (x, y)
+    # that keep its visual shape. The first and last points are always kept.
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_lo = hi
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo : max(next_hi, next_lo + 1)].mean()
+        avg_y = y[next_lo : max(next_hi, next_lo + 1)].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(df, columns, max_points=MAX_CHART_POINTS):
+    # Keep the rows LTTB picks for any of `columns`, sharing the point budget
+    if len(df) <= max_points:
+        return df
+    x = df["Date"].to_numpy(dtype="datetime64[s]").astype("float64")
+    n_out = max_points // len(columns)
+    keep = np.unique(
+        np.concatenate(
+            [
+                lttb(x, np.nan_to_num(df[col].to_numpy(dtype="float64")), n_out)
+                for col in columns
+            ]
+        )
     )
-    return df
-
-
-def plot_R(data, window):
-    df = smooth_data(data.data, window)
+    return df.iloc[keep]
+
+
+def filter_dates(df, start=None, end=None):
+    # Rows of a date-sorted frame within [start, end], as a slice of it
+    dates = df["Date"].to_numpy()
+    lo, hi = 0, len(df)
+    if start is not None:
+        lo = dates.searchsorted(pd.to_datetime(start).to_datetime64())
+    if end is not None:
+        hi = dates.searchsorted(pd.to_datetime(end).to_datetime64(), side="right")
+    return df.iloc[lo:hi]
+
+
+@instrument.timed()
+def plot_R(
+    data,
+    window,
+    start=None,
+    end=None,
+    max_points=MAX_CHART_POINTS,
+    estimator="SIR",
+    bands=None,
+):
+    import altair as alt
+
+    # Smooth over the full history, then only serialize the columns the chart
+    # uses, for the requested dates, downsampled to the point budget. All the
+    # layers below share this one dataset, attached to the outermost layer.
+    # `bands` are Monte Carlo quantiles from uncertainty.bands for the same
+    # rows, window and estimator.
+    df = smooth_data(data, window, estimator)
+    quantiles = []
+    if bands is not None:
+        quantiles = [f"R(t) {q}" for q in ["q05", "q50", "q95"]]
+        df = df.join(bands[quantiles])
+    df = filter_dates(df, start, end)
+    columns = ["Date", "R(t) (smoothed)", "New Cases (smoothed)", "New Cases"]
+    interval = ["R(t) lower", "R(t) upper"] if estimator == "Renewal" else []
+    df = df[columns + interval + quantiles].copy()
     df["R(t) (smoothed)"] = df["R(t) (smoothed)"].round(1)
+    df[interval + quantiles] = df[interval + quantiles].round(2)
     df["New Cases (smoothed)"] = df["New Cases (smoothed)"].round(0).astype(int)
+    df = downsample(df, ["R(t) (smoothed)", "New Cases (smoothed)"], max_points)
 
-    min_date = data.data["Date"].min()
     # Add a yval so that we can move the Points
-    int_df = data.province.interventions
-    int_df = int_df[int_df["Date"] >= min_date]
+    int_df = data.province.interventions_between(df["Date"].min(), end).copy()
     int_df["yval"] = 1
 
     scale = alt.Scale(
@@ -45,7 +152,7 @@ def plot_R(data, window):
     # Transparent selectors across the chart. This is what tells us
     # the x-value of the cursor
     selectors = (
-        alt.Chart(df)
+        alt.Chart()
         .mark_point()
         .encode(
             x="Date:T",
@@ -59,7 +166,7 @@ def plot_R(data, window):
     )
 
     R = (
-        alt.Chart(df)
+        alt.Chart()
         .mark_line(stroke="#662E9B")
         .transform_fold(
             fold=["R(t) (smoothed)", "New Cases (smoothed)"],
@@ -73,7 +180,7 @@ def plot_R(data, window):
     )
 
     C = (
-        alt.Chart(df)
+        alt.Chart()
         .mark_line(stroke="blue")
         .encode(
             x=alt.X("Date:T", axis=alt.Axis(title="Date")),
@@ -101,7 +208,7 @@ def plot_R(data, window):
 
     # Draw a rule at the location of the selection
     rules = (
-        alt.Chart(df)
+        alt.Chart()
         .mark_rule(color="gray")
         .encode(
             x="Date:T",
@@ -133,6 +240,29 @@ def plot_R(data, window):
         )
     )
 
+    # Shade the 95% interval of the renewal estimate
+    band = (
+        alt.Chart()
+        .mark_area(opacity=0.2, color="#662E9B")
+        .encode(
+            x="Date:T",
+            y=alt.Y("R(t) lower:Q", axis=alt.Axis(title="R(t)")),
+            y2="R(t) upper:Q",
+        )
+    )
+
+    # Shade the 5-95% Monte Carlo band
+    mc_band = (
+        alt.Chart()
+        .mark_area(opacity=0.2, color="orange")
+        .encode(
+            x="Date:T",
+            y=alt.Y("R(t) q05:Q", axis=alt.Axis(title="R(t)")),
+            y2="R(t) q95:Q",
+            tooltip=["Date:T", "R(t) q05:Q", "R(t) q50:Q", "R(t) q95:Q"],
+        )
+    )
+
     # Draw the R=1 reference line
     reference = (
         alt.Chart(pd.DataFrame({"y": [1]}))
@@ -141,9 +271,12 @@ def plot_R(data, window):
     )
 
     layer1 = R + selectors + rules + R_points + R_text + date_text + reference
-    daily_cases_df = data.data[["Date", "New Cases"]].copy()
+    if interval:
+        layer1 = band + layer1
+    if quantiles:
+        layer1 = mc_band + layer1
     daily_case_chart = (
-        alt.Chart(daily_cases_df)
+        alt.Chart()
         .mark_bar(opacity=0.25, color="grey")
         .encode(x=alt.X("Date:T"), y=alt.Y("New Cases:Q"))
     )
@@ -151,7 +284,7 @@ def plot_R(data, window):
 
     layer3 = interventions + areas
     chart = alt.layer(layer1, layer2).resolve_scale(y="independent")
-    chart = alt.layer(chart, layer3).resolve_scale(
+    chart = alt.layer(chart, layer3, data=df).resolve_scale(
         x="shared", color="independent", shape="independent"
     )
 
@@ -159,9 +292,25 @@ def plot_R(data, window):
     return chart
 
 
-def plot_immunity(data):
-    df = data.data[["Date", "Immunity (Lower Bound)", "Immunity (Upper Bound)"]].copy()
-    df = df.set_index("Date").rolling(window="14d").mean().reset_index()
+@instrument.timed()
+def plot_immunity(
+    data, start=None, end=None, max_points=MAX_CHART_POINTS, bands=None
+):
+    import altair as alt
+
+    # 14-day trailing means, from prefix sums over the daily grid. `bands` are
+    # Monte Carlo quantiles from uncertainty.bands for the same rows.
+    columns = ["Immunity (Lower Bound)", "Immunity (Upper Bound)"]
+    quantiles = []
+    source = data.data
+    if bands is not None:
+        quantiles = [f"Immunity {q}" for q in ["q05", "q50", "q95"]]
+        source = source.join(bands[quantiles])
+    df = filter_dates(data.data[["Date"]], start, end)
+    means = rolling_means(source, columns + quantiles, [14]).loc[df.index]
+    df = df.assign(**dict(zip(columns + quantiles, means.to_numpy().T)))
+    df = downsample(df, columns, max_points)
+    df[columns + quantiles] = df[columns + quantiles].round(4)
 
     chart = (
         alt.Chart(df)
@@ -178,10 +327,38 @@ def plot_immunity(data):
         )
     )
 
+    if quantiles:
+        # The 5-95% Monte Carlo band and its median. Altair stores the shared
+        # dataset once.
+        mc_band = (
+            alt.Chart(df)
+            .mark_area(opacity=0.3, color="orange")
+            .encode(
+                x="Date:T",
+                y=alt.Y("Immunity q05:Q", axis=alt.Axis(format="%")),
+                y2="Immunity q95:Q",
+            )
+        )
+        median = (
+            alt.Chart(df)
+            .mark_line(color="orange")
+            .encode(
+                x="Date:T",
+                y="Immunity q50:Q",
+                tooltip=["Date:T", "Immunity q05", "Immunity q50", "Immunity q95"],
+            )
+        )
+        chart = alt.layer(chart, mc_band, median)
+
     return chart
 
 
 def integrate_a(df_in):
+    try:
+        from scipy.integrate import cumulative_trapezoid as cumtrapz
+    except ImportError:  # scipy < 1.6
+        from scipy.integrate import cumtrapz
+
     # Start from rest @ x=0
     # v_0 = 0
     # x_0 = 0
@@ -194,14 +371,15 @@ def integrate_a(df_in):
     v = cumtrapz(a, x=delta_t)
     x = cumtrapz(v[:], x=delta_t[1:])
 
-    df_out["Velocity"] = 0
-    df_out["Position"] = 0
+    df_out["Velocity"] = 0.0
+    df_out["Position"] = 0.0
     df_out.loc[1:, "Velocity"] = v
     df_out.loc[2:, "Position"] = x
     return df_out
 
 
 def plot_acceleration():
+    import altair as alt
 
     df = pd.DataFrame(
         {
@@ -213,15 +391,17 @@ def plot_acceleration():
         }
     )
     n_time = df["Date"].count()
-    df["Acceleration"] = 0
+    df["Acceleration"] = 0.0
     df.loc[10:20, "Acceleration"] = 0.1
     df.loc[50:55, "Acceleration"] = -0.1
     df.loc[150:153, "Acceleration"] = -0.1
 
     df = integrate_a(df)
 
+    df = df[["Date", "Acceleration", "Velocity"]]
+
     A = (
-        alt.Chart(df)
+        alt.Chart()
         .mark_line(stroke="green")
         .encode(
             x=alt.X("Date:T", axis=alt.Axis(title="Date")),
@@ -230,7 +410,7 @@ def plot_acceleration():
     )
 
     X = (
-        alt.Chart(df)
+        alt.Chart()
         .mark_line(stroke="red")
         .encode(
             x=alt.X("Date:T", axis=alt.Axis(title="Date")),
@@ -238,12 +418,53 @@ def plot_acceleration():
         )
     )
 
-    chart = alt.layer(A, X).resolve_scale(y="independent")
+    chart = alt.layer(A, X, data=df).resolve_scale(y="independent")
 
     return chart
 
 
+def memo_data(province, as_of_date):
+    return memo.DATA.get(
+        (province, as_of_date),
+        lambda: Data(province, as_of_date=as_of_date),
+        expires=memo.expires(as_of_date),
+    )
+
+
+def memo_region_data(region, as_of_date):
+    return memo.DATA.get(
+        ("region", region, as_of_date),
+        lambda: regions.RegionData(region, as_of_date=as_of_date),
+        expires=memo.expires(as_of_date),
+    )
+
+
+def memo_bands(data, window, estimator):
+    # Monte Carlo bands of one province or region, with the default assumptions
+    return memo.DATA.get(
+        ("bands", data.key, data.name, data.as_of_date, window, estimator),
+        lambda: uncertainty.bands(
+            data.data,
+            {data.name: data.population},
+            window=window,
+            estimator=estimator,
+            key=data.key,
+        ),
+        expires=memo.expires(data.as_of_date),
+    )
+
+
+def memo_chart(key, as_of_date, build):
+    # The Vega-Lite spec of `build()`, keyed on everything the chart depends on
+    return memo.CHARTS.get(
+        key, lambda: build().to_dict(), expires=memo.expires(as_of_date)
+    )
+
+
 def app():
+    import streamlit as st
+
+    instrument.reset()
 
     today = pd.to_datetime(datetime.datetime.now().date())
 
@@ -254,15 +475,37 @@ def app():
         "Select Province", options=prov_options, index=default_index
     )
 
-    data = Data(province_selection)
+    # Past dates show the data as it was archived on that day
+    as_of_date = st.sidebar.date_input(
+        label="Data as of", value=today, max_value=today
+    )
+    # Health regions are offered when the regional feeds are available
+    region_options = regions.regions_of(province_selection, as_of_date)
+    region_selection = None
+    if region_options:
+        region_selection = st.sidebar.selectbox(
+            "Health region", options=["All regions"] + region_options
+        )
+        if region_selection == "All regions":
+            region_selection = None
+    try:
+        if region_selection is None:
+            data = memo_data(province_selection, as_of_date)
+        else:
+            data = memo_region_data(region_selection, as_of_date)
+    except FileNotFoundError:
+        st.error(f"No data was archived on or before {as_of_date}.")
+        st.stop()
 
     st.sidebar.write("Limit the view of the data:")
     d1 = st.sidebar.date_input(label="Start Date", value=pd.to_datetime("03-01-2020"))
     d2 = st.sidebar.date_input(label="End Date", value=today)
-
-    date_mask = data.data["Date"] >= pd.to_datetime(d1)
-    date_mask = date_mask & (data.data["Date"] <= pd.to_datetime(d2))
-    data.data = data.data[date_mask]
+    window = st.sidebar.select_slider(
+        "Smoothing window (days)", options=SMOOTHING_WINDOWS, value=7
+    )
+    estimator = st.sidebar.radio("R(t) estimator", options=ESTIMATORS)
+    show_bands = st.sidebar.checkbox("Monte Carlo uncertainty bands")
+    bands = memo_bands(data, window, estimator) if show_bands else None
 
     st.markdown(
         """
@@ -313,7 +556,11 @@ def app():
 
     # When one solves these equations, some constants of integration fall out
     # """)
-    st.altair_chart(plot_acceleration(), use_container_width=True)
+    with instrument.stage("render:plot_acceleration"):
+        st.vega_lite_chart(
+            memo_chart(("acceleration",), as_of_date, plot_acceleration),
+            use_container_width=True,
+        )
 
     st.write(
         """
@@ -337,6 +584,10 @@ def app():
     * the symbols are a Red up arrow for tighted restrictions, Green down arrow for eased restrictions and Blue diamond for events like holidays
     * you can hover over the chart to get more information
     * the $R$ line is color coded so that if it is $<1$ it is green, else it is red 
+    * with the Renewal estimator (see the sidebar), $R$ is estimated from new cases and the serial interval 
+    ([Cori et al., 2013](https://doi.org/10.1093/aje/kwt133)) and the shaded band is its 95% credible interval
+    * with Monte Carlo uncertainty bands (see the sidebar), the orange band spans the 5th to 95th percentile of $R$ over
+    10,000 draws of under-reporting, daily reporting noise and vaccine effectiveness
 
     There is a very important consideration while interpretting the following: 
     There is a lag between when an intervention is implemented and when we would expect to see an effect.
@@ -346,7 +597,48 @@ def app():
     """
     )
     # st.write(data.province.interventions)
-    st.altair_chart(plot_R(data, 7), use_container_width=True)
+    with instrument.stage("render:plot_R"):
+        st.vega_lite_chart(
+            memo_chart(
+                (
+                    "R",
+                    config.intervention_version(),
+                    data.name,
+                    as_of_date,
+                    d1,
+                    d2,
+                    window,
+                    estimator,
+                    show_bands,
+                ),
+                as_of_date,
+                lambda: plot_R(data, window, d1, d2, estimator=estimator, bands=bands),
+            ),
+            use_container_width=True,
+        )
+
+    st.markdown(
+        """
+    ### Estimating the lag
+
+    Rather than assuming the lag, the following compares the mean $R$ over the chosen smoothing window before every 
+    intervention in every province with its mean over a window starting 0 to 42 days after it. 
+    Each cell is the average change in $R$ for that type of intervention and lag; 
+    the table lists the lag with the largest average change for each type.
+    """
+    )
+    summary = get_summary(as_of_date)
+    with instrument.stage("render:plot_lags"):
+        st.vega_lite_chart(
+            memo_chart(
+                ("lags", config.intervention_version(), as_of_date, window),
+                as_of_date,
+                lambda: plot_lags(summary, window),
+            ),
+            use_container_width=True,
+        )
+    lags = estimated_lags(summary)
+    st.dataframe(lags[lags["Window"] == window].drop(columns="Window"))
 
     st.markdown("## The Path to Herd Immunity")
     st.markdown(
@@ -365,9 +657,20 @@ def app():
     has estimated that (especially early in the pandemic) 1 in 4.6 infections were reported. This is for the US, however it is not unreasonable to
     assume a similar value for Canada. For simplicity, I chose a value of 5. 
     The upper bound is calculated as the number of daily cases * 5 + # vaccinated.
+
+    With Monte Carlo uncertainty bands, the orange band and line are the 5th to 95th percentile and the median of immunity
+    when 1 to 6 infections per reported case, noisy daily reports and a vaccine effectiveness of 60% to 95% are all sampled.
     """
     )
-    st.altair_chart(plot_immunity(data), use_container_width=True)
+    with instrument.stage("render:plot_immunity"):
+        st.vega_lite_chart(
+            memo_chart(
+                ("immunity", data.name, as_of_date, d1, d2, show_bands),
+                as_of_date,
+                lambda: plot_immunity(data, d1, d2, bands=bands),
+            ),
+            use_container_width=True,
+        )
 
     with st.expander("Footnotes"):
         st.markdown(
@@ -377,8 +680,20 @@ def app():
         """
         )
 
+    # Only shown when the app runs with COVID_DIAGNOSTICS set. A section of
+    # its own rather than an expander, which the page style below hides.
+    if instrument.ENABLED:
+        st.markdown("## Diagnostics")
+        st.dataframe(pd.DataFrame(instrument.records()))
+        st.dataframe(data.memory_report())
+        st.dataframe(
+            pd.DataFrame({"Data": memo.DATA.stats(), "Charts": memo.CHARTS.stats()}).T
+        )
+
 
 if __name__ == "__main__":
+    import streamlit as st
+
     st.set_page_config(layout="wide")
 
     st.markdown(
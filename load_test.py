@@ -0,0 +1,145 @@
+import argparse
+import datetime
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from api import ApiServer, Export
+
+
+def synthetic_export(region_scale=1, history_scale=1):
+    # An Export of the synthetic benchmark panel, so the server needs no data
+    from benchmark import synthetic_inputs
+    from data import SMOOTHED_COLUMNS, build_panel, rolling_means
+    from renewal import renewal_R
+
+    panel = build_panel(*synthetic_inputs(region_scale, history_scale))
+    frame = panel.join(rolling_means(panel, SMOOTHED_COLUMNS)).join(renewal_R(panel))
+    return Export(frame, datetime.date.today())
+
+
+def request_mix(provinces, first, last, n, all_share=0.1, seed=0):
+    # (path, params) of `n` requests: one province (or all of them for
+    # `all_share` of the requests) over a random date range, as Arrow or JSON
+    rng = np.random.default_rng(seed)
+    days = (last - first).days
+    mix = []
+    for _ in range(n):
+        path = "/panel"
+        if rng.random() >= all_share:
+            path += "/" + provinces[rng.integers(len(provinces))]
+        lo, hi = np.sort(rng.integers(0, days + 1, 2))
+        params = {
+            "start": str(first + datetime.timedelta(days=int(lo))),
+            "end": str(first + datetime.timedelta(days=int(hi))),
+            "format": ["arrow", "json"][rng.integers(2)],
+        }
+        mix.append((path, params))
+    return mix
+
+
+def run(url, mix, concurrency, conditional):
+    """Send `mix` to the server at `url` from `concurrency` threads.
+
+    With `conditional`, a request repeats the If-None-Match of the last
+    response to the same URL, as a caching client would. Returns the
+    latency of every request in seconds, the status counts, the bytes
+    received and the wall time.
+    """
+    local = threading.local()
+    etags = {}
+    lock = threading.Lock()
+
+    def send(request):
+        path, params = request
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        key = (path, tuple(sorted(params.items())))
+        headers = {"Accept-Encoding": "gzip"}
+        if conditional and key in etags:
+            headers["If-None-Match"] = etags[key]
+        begin = time.perf_counter()
+        response = local.session.get(url + path, params=params, headers=headers)
+        size = len(response.content)
+        elapsed = time.perf_counter() - begin
+        if "ETag" in response.headers:
+            with lock:
+                etags[key] = response.headers["ETag"]
+        return elapsed, response.status_code, size
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, mix))
+    wall = time.perf_counter() - begin
+    latencies = np.array([elapsed for elapsed, _, _ in results])
+    statuses = Counter(status for _, status, _ in results)
+    received = sum(size for _, _, size in results)
+    return latencies, statuses, received, wall
+
+
+def report(latencies, statuses, received, wall):
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+    n = len(latencies)
+    print(f"{n:,} requests in {wall:.2f}s: {n / wall:.0f} req/s")
+    print(
+        f"latency p50 {p50:.1f}ms, p90 {p90:.1f}ms, p99 {p99:.1f}ms, "
+        f"max {latencies.max() * 1000:.1f}ms"
+    )
+    print(
+        f"received {received / 2**20:.1f} MB ({received / 2**20 / wall:.1f} MB/s), "
+        f"status {dict(sorted(statuses.items()))}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the panel API (api.py) with a mix of queries"
+    )
+    parser.add_argument(
+        "--url", help="A running server; by default one is started in-process"
+    )
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="Serve the synthetic benchmark panel instead of the cached data",
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--distinct",
+        type=int,
+        default=50,
+        help="Distinct queries in the mix; the rest repeat them",
+    )
+    parser.add_argument(
+        "--conditional",
+        action="store_true",
+        help="Revalidate repeated queries with If-None-Match",
+    )
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        export = synthetic_export() if args.synthetic else None
+        server = ApiServer(export=export).__enter__()
+        url = server.url
+    try:
+        provinces = requests.get(url + "/provinces").json()
+        provinces = [province["abbr"] or province["name"] for province in provinces]
+        first, last = datetime.date(2020, 3, 1), datetime.date.today()
+        queries = request_mix(provinces, first, last, args.distinct)
+        picks = np.random.default_rng(1).integers(len(queries), size=args.requests)
+        mix = [queries[i] for i in picks]
+        report(*run(url, mix, args.concurrency, args.conditional))
+    finally:
+        if server is not None:
+            server.__exit__(None, None, None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+
+def next_refresh(as_of_date):
+    # Upstream snapshots are taken once per as_of_date, so anything derived
+    # from one is stale by the start of the following day
+    day = datetime.date.fromisoformat(str(as_of_date)[:10])
+    tomorrow = day + datetime.timedelta(days=1)
+    return datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+
+
+def expires(as_of_date):
+    # The `expires` of an entry derived from `as_of_date`: the next refresh
+    # for today's data, and None (only the TTL) for a past date's, which is
+    # read from the archive and never changes
+    day = datetime.date.fromisoformat(str(as_of_date)[:10])
+    if day < datetime.date.today():
+        return None
+    return next_refresh(day)
+
+
+class Memo:
+    """Size-bounded LRU cache whose entries also expire.
+
+    Entries expire `ttl` seconds after they are computed, or at the `expires`
+    timestamp given with them if that is sooner. Hits, misses and evictions
+    are counted for diagnostics. Cached values are shared, so callers must not
+    mutate them.
+    """
+
+    def __init__(self, maxsize=64, ttl=3600, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, compute, expires=None):
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = compute()
+        deadline = now + self.ttl
+        if expires is not None:
+            deadline = min(deadline, expires)
+        with self.lock:
+            self.entries[key] = (deadline, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Province views and serialized chart specs of the app, shared by every
+# session and rerun. They live here rather than in the app script, which
+# streamlit re-executes on every rerun. Entries expire an hour after they are
+# built or, for today's data, when the next upstream snapshot is due,
+# whichever comes first.
+DATA = Memo(maxsize=16, ttl=3600)
+CHARTS = Memo(maxsize=256, ttl=3600)
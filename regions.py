@@ -0,0 +1,327 @@
+import datetime
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import cache
+import config
+import instrument
+import memo
+from data import (
+    CASE_COUNT_COLUMNS,
+    SMOOTHED_COLUMNS,
+    Data,
+    add_immunity,
+    build_panel,
+    calculate_R,
+    get_vaccine_history,
+    province_ranges,
+    resample_daily,
+    rolling_means,
+    sorted_by_province,
+)
+from renewal import renewal_R
+
+# Levels of the hierarchy, finest first. Each is also the name of the column
+# holding it: every row of the regional panel has its Region, Province and
+# Country, and the rolled-up panels the levels above their own.
+LEVELS = ["Region", "Province", "Country"]
+COUNTRY = "Canada"
+
+REGION_DATA_URL = "https://api.opencovid.ca/other?stat=hr"
+REGION_CASES_URL = "https://api.opencovid.ca/timeseries?stat=cases&loc=hr&ymd=true"
+REGION_DEATHS_URL = (
+    "https://api.opencovid.ca/timeseries?stat=mortality&loc=hr&ymd=true"
+)
+
+# The regional feeds have no recoveries, so a case counts as active for this
+# many days after it is reported
+INFECTIOUS_DAYS = 14
+
+# Province names of the regional feeds that are neither a name nor an
+# abbreviation in province_data
+PROVINCE_ALIASES = {
+    "BC": "British Columbia",
+    "NL": "Newfoundland and Labrador",
+    "NWT": "Northwest Territories",
+    "PEI": "Prince Edward Island",
+}
+
+# Counts that add up over the regions of a province
+SUMMED_COLUMNS = CASE_COUNT_COLUMNS + ["New Vaccinated", "Total Vaccinated"]
+
+
+def parse_region_data(body):
+    df = pd.DataFrame(json.load(body)["hr"])
+    df = df.rename(
+        columns={
+            "health_region": "Region",
+            "province": "Province",
+            "HR_UID": "code",
+            "pop": "population",
+        }
+    )
+    if "population" not in df:
+        df["population"] = np.nan
+    return df[["Region", "Province", "code", "population"]]
+
+
+def parse_region_cases(body):
+    df = pd.DataFrame(json.load(body)["cases"])
+    df = df.rename(
+        columns={
+            "health_region": "Region",
+            "province": "Province",
+            "date_report": "Date",
+            "cases": "New Cases",
+            "cumulative_cases": "Total Cases",
+        }
+    )
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df[["Region", "Province", "Date", "New Cases", "Total Cases"]]
+
+
+def parse_region_deaths(body):
+    df = pd.DataFrame(json.load(body)["mortality"])
+    df = df.rename(
+        columns={
+            "health_region": "Region",
+            "province": "Province",
+            "date_death_report": "Date",
+            "deaths": "New Deaths",
+            "cumulative_deaths": "Total Deaths",
+        }
+    )
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df[["Region", "Province", "Date", "New Deaths", "Total Deaths"]]
+
+
+def normalize_regions(df):
+    # Full province names, and region names made unique by their province's
+    # abbreviation ("Not Reported" appears in every province), as in
+    # "Calgary (AB)". Applied after loading, like data.normalize_provinces.
+    names = dict(PROVINCE_ALIASES)
+    names.update(config.province_data[["abbr", "name"]].values)
+    names.update(config.province_data[["name", "name"]].values)
+    abbrs = dict(config.province_data[["name", "abbr"]].values)
+    province = df["Province"].astype(str)
+    province = province.map(lambda x: names.get(x, x))
+    abbr = province.map(lambda x: abbrs.get(x, x))
+    return df.assign(
+        Region=pd.Categorical(df["Region"].astype(str) + " (" + abbr + ")"),
+        Province=pd.Categorical(province),
+        Country=pd.Categorical([COUNTRY] * len(df)),
+    )
+
+
+@instrument.timed()
+def region_case_data(cases, deaths):
+    """Regional cases and deaths in the schema of data.get_case_data.
+
+    Rows are keyed by Region, with the Province and Country of each region,
+    on a daily grid. The feeds have no recoveries or active cases: active
+    cases are the cases reported in the last INFECTIOUS_DAYS days, and every
+    other case that is not a death has recovered.
+    """
+    deaths = deaths[["Region", "Date", "New Deaths", "Total Deaths"]]
+    df = cases.merge(deaths, on=["Region", "Date"], how="left")
+    counts = ["New Cases", "Total Cases", "New Deaths", "Total Deaths"]
+    df[counts] = df[counts].fillna(0).astype("int64")
+    df["Region"] = df["Region"].astype("category")
+    df = resample_daily(df, key="Region").drop(columns="Reported")
+
+    codes, _ = pd.factorize(df["Region"])
+    starts = np.diff(codes, prepend=-1) != 0
+    total = df["Total Cases"].to_numpy(dtype="int64")
+    earlier = np.zeros(len(df), dtype="int64")
+    same = codes[INFECTIOUS_DAYS:] == codes[:-INFECTIOUS_DAYS]
+    earlier[INFECTIOUS_DAYS:] = np.where(same, total[:-INFECTIOUS_DAYS], 0)
+    active = total - earlier
+    recovered = np.maximum(total - active - df["Total Deaths"].to_numpy(), 0)
+    new_recovered = np.diff(recovered, prepend=0)
+    new_recovered[starts] = recovered[starts]
+    df["Active Cases"] = active
+    df["Total Recovered"] = recovered
+    df["New Recovered"] = new_recovered
+    return df.astype({col: "int32" for col in CASE_COUNT_COLUMNS})
+
+
+def allocate_vaccines(vaccines, regions):
+    # The vaccine feed is provincial: each region gets its population share of
+    # its province's vaccinations, rounded down
+    regions = regions.dropna(subset=["population"])
+    totals = regions.groupby("Province", observed=True)["population"].transform("sum")
+    share = regions["population"] / totals
+    shares = regions[["Region", "Province"]].assign(share=share)
+    df = vaccines.assign(Province=vaccines["Province"].astype(str)).merge(
+        shares.astype({"Province": str}), on="Province"
+    )
+    for col in ["New Vaccinated", "Total Vaccinated"]:
+        share = df[col].fillna(0).to_numpy(dtype="float64") * df["share"].to_numpy()
+        df[col] = np.floor(share).astype("int64")
+    return df[["Date", "Region", "New Vaccinated", "Total Vaccinated"]]
+
+
+def populations(regions):
+    # {level: population of each of its series}, summed over the regions
+    return {
+        level: regions.groupby(level, observed=True)["population"].sum(min_count=1)
+        for level in LEVELS
+    }
+
+
+@instrument.timed()
+def roll_up(panel, regions, level="Province"):
+    """One series per province (or for the country) summed from `panel`.
+
+    Every count of the regional panel is placed on a (region, day, count)
+    array and the regions of each province are summed in one reduceat, so
+    nothing is recomputed from the feeds. Populations are summed the same
+    way, and immunity and R(t) are then derived from the sums.
+    """
+    panel = sorted_by_province(panel, key="Region")
+    codes, _ = pd.factorize(panel["Region"])
+    first = np.flatnonzero(np.diff(codes, prepend=-1) != 0)
+    parent, parents = pd.factorize(panel[level].to_numpy()[first])
+    day0 = panel["Date"].min()
+    day = ((panel["Date"] - day0) // pd.Timedelta(days=1)).to_numpy()
+    n_days = day.max() + 1 if len(panel) else 0
+
+    grid = np.zeros((len(first), n_days, len(SUMMED_COLUMNS)), dtype="int64")
+    grid[codes, day] = panel[SUMMED_COLUMNS].to_numpy(dtype="int64")
+    present = np.zeros((len(first), n_days), dtype=bool)
+    present[codes, day] = True
+    order = np.argsort(parent, kind="stable")
+    bounds = np.flatnonzero(np.diff(parent[order], prepend=-1) != 0)
+    sums = np.add.reduceat(grid[order], bounds, axis=0)
+    rows, days = np.nonzero(np.logical_or.reduceat(present[order], bounds, axis=0))
+
+    names = np.asarray(parents)[parent[order][bounds]]
+    df = pd.DataFrame(
+        {
+            level: pd.Categorical(names[rows]),
+            "Date": day0 + pd.to_timedelta(days, unit="D"),
+        }
+    )
+    for above in LEVELS[LEVELS.index(level) + 1 :]:
+        lookup = panel[above].to_numpy()[first][np.argsort(parent, kind="stable")]
+        df[above] = pd.Categorical(lookup[bounds][rows])
+    for i, col in enumerate(SUMMED_COLUMNS):
+        df[col] = sums[rows, days, i].astype("int32")
+
+    population = populations(regions)[level]
+    df = add_immunity(df, population, key=level)
+    return calculate_R(df, population, key=level)
+
+
+@instrument.timed()
+def build_levels(cases, vaccines, regions):
+    # {level: panel}: the regional panel, built in one batched pass over every
+    # region, and the provinces and country rolled up from it
+    population = regions.set_index("Region")["population"]
+    panel = build_panel(
+        cases, allocate_vaccines(vaccines, regions), population, key="Region"
+    )
+    levels = {"Region": panel}
+    for level in LEVELS[1:]:
+        levels[level] = roll_up(panel, regions, level)
+    return levels
+
+
+@instrument.timed()
+def smooth_levels(levels, regions):
+    # Everything a view of one series needs, by level: the panel, its smoothed
+    # and renewal columns (each level in one pass), the row range and the
+    # population of every series
+    population = populations(regions)
+    return {
+        level: {
+            "panel": panel,
+            "smoothed": rolling_means(panel, SMOOTHED_COLUMNS, key=level),
+            "renewal": renewal_R(panel, key=level),
+            "ranges": province_ranges(panel, key=level),
+            "population": population[level],
+        }
+        for level, panel in levels.items()
+    }
+
+
+REGION_SOURCES = [
+    ("regions", REGION_DATA_URL, parse_region_data),
+    ("region_cases", REGION_CASES_URL, parse_region_cases),
+    ("region_deaths", REGION_DEATHS_URL, parse_region_deaths),
+]
+
+
+@lru_cache(maxsize=4)
+@instrument.timed()
+def get_region_data(as_of_date):
+    # Region metadata and case series, downloaded concurrently
+    with ThreadPoolExecutor(max_workers=len(REGION_SOURCES)) as pool:
+        futures = [
+            pool.submit(cache.cached_frame, source, url, as_of_date, parse)
+            for source, url, parse in REGION_SOURCES
+        ]
+        regions, cases, deaths = [
+            normalize_regions(future.result()) for future in futures
+        ]
+    return regions, region_case_data(cases, deaths)
+
+
+@lru_cache(maxsize=4)
+@instrument.timed()
+def get_levels(as_of_date):
+    regions, cases = get_region_data(as_of_date)
+    vaccines, _ = get_vaccine_history(as_of_date)
+    return smooth_levels(build_levels(cases, vaccines, regions), regions)
+
+
+# The region table of each as_of_date, or None if the feeds failed to load.
+# A failure is remembered for the TTL so that reruns of the app do not retry
+# the downloads every time.
+REGION_TABLES = memo.Memo(maxsize=4, ttl=300)
+
+
+def region_table(as_of_date):
+    def load():
+        try:
+            regions, _ = get_region_data(as_of_date)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        return regions
+
+    return REGION_TABLES.get(as_of_date, load)
+
+
+def regions_of(province, as_of_date):
+    # Names of the regions of `province`, or none if the regional feeds
+    # cannot be loaded
+    regions = region_table(as_of_date)
+    if regions is None:
+        return []
+    return sorted(regions.loc[regions["Province"] == province, "Region"].astype(str))
+
+
+class RegionData(Data):
+    # One region, or rolled-up province, shaped like data.Data so the charts
+    # of intervention_analysis take it as is. Interventions are recorded per
+    # province, so a region shows its province's. `levels` is the output of
+    # smooth_levels, by default that of `as_of_date`.
+    @instrument.timed("RegionData")
+    def __init__(self, name, level="Region", as_of_date=None, levels=None):
+        self.as_of_date = as_of_date or datetime.date.today()
+        if levels is None:
+            levels = get_levels(self.as_of_date)
+        level_data = levels[level]
+        if name not in level_data["ranges"]:
+            raise KeyError(name)
+        rows = slice(*level_data["ranges"][name])
+        self.data = level_data["panel"].iloc[rows]
+        self.smoothed = level_data["smoothed"].iloc[rows]
+        self.renewal = level_data["renewal"].iloc[rows]
+        self.province = config.Province(str(self.data["Province"].iloc[0]))
+        self.key, self.name = level, name
+        self.population = level_data["population"].get(name, np.nan)
@@ -0,0 +1,103 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from data import SMOOTHING_WINDOWS, grid_positions
+
+# Serial interval of COVID-19 in days (Nishiura et al., 2020)
+SERIAL_INTERVAL_MEAN = 4.7
+SERIAL_INTERVAL_SD = 2.9
+SERIAL_INTERVAL_MAX = 21
+
+# Gamma prior on R(t) with mean PRIOR_SHAPE * PRIOR_SCALE, as in EpiEstim
+PRIOR_SHAPE = 1.0
+PRIOR_SCALE = 5.0
+
+Z_975 = 1.959964
+
+
+def serial_interval(
+    mean=SERIAL_INTERVAL_MEAN, sd=SERIAL_INTERVAL_SD, max_days=SERIAL_INTERVAL_MAX
+):
+    # Discretized gamma density over 1..max_days, normalized to sum to 1
+    shape = (mean / sd) ** 2
+    scale = sd**2 / mean
+    days = np.arange(1, max_days + 1)
+    log_density = (shape - 1) * np.log(days) - days / scale
+    log_density -= shape * math.log(scale) + math.lgamma(shape)
+    weights = np.exp(log_density)
+    return weights / weights.sum()
+
+
+def gamma_quantile(shape, rate, z):
+    # Wilson-Hilferty approximation of the gamma quantile at standard normal z
+    cube = 1 - 1 / (9 * shape) + z / (3 * np.sqrt(shape))
+    return shape * np.clip(cube, 0, None) ** 3 / rate
+
+
+def estimate_R(incidence, windows=SMOOTHING_WINDOWS, weights=None):
+    """Cori et al. (2013) renewal-equation estimate of R(t).
+
+    `incidence` holds daily new cases shaped (region, day). Returns the
+    posterior mean and 95% interval, each shaped (window, region, day), for
+    every region and every window length in `windows` at once. Days without a
+    full window of history, or with no infectious pressure, are NaN.
+    """
+    if weights is None:
+        weights = serial_interval()
+    incidence = np.nan_to_num(np.asarray(incidence, dtype="float64")).clip(min=0)
+    n_regions, n_days = incidence.shape
+
+    # Total infectiousness: incidence convolved with the serial interval
+    pressure = np.zeros_like(incidence)
+    for lag, weight in enumerate(weights, start=1):
+        if lag >= n_days:
+            break
+        pressure[:, lag:] += weight * incidence[:, :-lag]
+
+    # Sums over the trailing window of each length, from prefix sums
+    zeros = np.zeros((n_regions, 1))
+    incidence_sums = np.concatenate([zeros, incidence.cumsum(axis=1)], axis=1)
+    pressure_sums = np.concatenate([zeros, pressure.cumsum(axis=1)], axis=1)
+    windows = np.asarray(windows)
+    hi = np.arange(1, n_days + 1)
+    lo = hi[None, :] - windows[:, None]
+    full = lo >= 1  # the first day has no infectious pressure yet
+    lo = lo.clip(min=0)
+    cases = incidence_sums[:, hi][None] - incidence_sums[:, lo].transpose(1, 0, 2)
+    pressure = pressure_sums[:, hi][None] - pressure_sums[:, lo].transpose(1, 0, 2)
+
+    shape = PRIOR_SHAPE + cases
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = 1 / PRIOR_SCALE + pressure
+        valid = full[:, None, :] & (pressure > 0)
+        mean = np.where(valid, shape / rate, np.nan)
+        lower = np.where(valid, gamma_quantile(shape, rate, -Z_975), np.nan)
+        upper = np.where(valid, gamma_quantile(shape, rate, Z_975), np.nan)
+    return mean, lower, upper
+
+
+@instrument.timed()
+def renewal_R(df, windows=SMOOTHING_WINDOWS, weights=None, key="Province"):
+    # estimate_R over every province of a panel, returned as columns
+    # "R(t) renewal (<w>d)" with " lower"/" upper" bounds, aligned to df's rows
+    names = [
+        f"R(t) renewal{bound} ({window}d)"
+        for window in windows
+        for bound in ["", " lower", " upper"]
+    ]
+    if len(df) == 0:
+        return pd.DataFrame(columns=names, index=df.index, dtype="float32")
+
+    position, _, shape = grid_positions(df, key)
+    incidence = np.zeros(shape[0] * shape[1])
+    incidence[position] = df["New Cases"].to_numpy(dtype="float64")
+    incidence = incidence.reshape(shape)
+    # One window at a time, stored as float32 in (row, window, bound) order
+    columns = np.empty((len(df), len(windows), 3), dtype="float32")
+    for i, window in enumerate(windows):
+        for bound, estimate in enumerate(estimate_R(incidence, [window], weights)):
+            columns[:, i, bound] = estimate[0].ravel()[position]
+    return pd.DataFrame(columns.reshape(len(df), -1), columns=names, index=df.index)
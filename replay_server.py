@@ -0,0 +1,91 @@
+import hashlib
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+
+def recording_path(directory, url):
+    # Recordings are stored by the path and query of the upstream URL
+    parts = urlsplit(url)
+    key = parts.path + ("?" + parts.query if parts.query else "")
+    return Path(directory) / hashlib.sha1(key.encode()).hexdigest()
+
+
+class ReplayServer:
+    """Local stand-in for the upstream sources.
+
+    Serves recorded bodies from `directory` (see fetch.record) or the `bodies`
+    dict ({url: bytes}), with ETag/Last-Modified validators. `latency` maps a
+    URL path to seconds of delay per request, and `failures` maps a path to the
+    number of requests that fail with a 503 before it starts answering.
+
+        with ReplayServer(bodies=..., latency={"/timeseries": 0.5}) as server:
+            fetch.UPSTREAM = server.url
+    """
+
+    def __init__(self, directory=None, bodies=None, latency=None, failures=None):
+        self.directory = directory
+        self.bodies = {}
+        for url, body in (bodies or {}).items():
+            parts = urlsplit(url)
+            self.bodies[parts.path + ("?" + parts.query if parts.query else "")] = body
+        self.latency = latency or {}
+        self.failures = dict(failures or {})
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.last_modified = formatdate(usegmt=True)
+
+    def body(self, key):
+        if key in self.bodies:
+            return self.bodies[key]
+        if self.directory is not None:
+            path = recording_path(self.directory, key)
+            if path.exists():
+                return path.read_bytes()
+
+    def handler(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                with replay.lock:
+                    replay.requests.append(self.path)
+                    failing = replay.failures.get(path, 0) > 0
+                    if failing:
+                        replay.failures[path] -= 1
+                time.sleep(replay.latency.get(path, 0))
+
+                body = replay.body(self.path)
+                if failing or body is None:
+                    self.send_error(503 if failing else 404)
+                    return
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", replay.last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,174 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from data import population_of, sir_compartments
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+THRESHOLDS = (0.7, 0.8, 0.9)
+
+
+def initial_state(panel, population):
+    # Latest S/I/R of every province, as fractions of its population. People
+    # who are vaccinated are moved from S to R.
+    latest = panel.sort_values("Date").groupby("Province", observed=True).tail(1)
+    latest = latest[latest["Province"].isin(population.index)]
+    sir = sir_compartments(latest, population)
+    vaccinated = latest["Total Vaccinated"] / population_of(latest, population)
+    sir["S"] = (sir["S"] - vaccinated).clip(lower=0)
+    sir["R"] = sir["R"] + vaccinated
+    sir.index = latest["Province"].astype(str)
+    sir["Date"] = latest["Date"].to_numpy()
+    return sir.sort_index()
+
+
+def sample_scenarios(
+    n, r0=(0.8, 2.5), infectious_days=(7, 14), vaccination=(0, 0.01), seed=0
+):
+    # Uniformly sampled transmission, recovery and vaccination rates (per day;
+    # vaccination is the fraction of the susceptible population per day)
+    rng = np.random.default_rng(seed)
+    gamma = 1 / rng.uniform(*infectious_days, n)
+    return {
+        "beta": rng.uniform(*r0, n) * gamma,
+        "gamma": gamma,
+        "vaccination": rng.uniform(*vaccination, n),
+    }
+
+
+def derivatives(S, I, beta, gamma, vaccination):
+    # dS/dt and dI/dt, plus the new infections (beta * S * I) that make up
+    # the daily cases; R is whatever is left, so it is not integrated
+    infections = beta * S * I
+    return -infections - vaccination * S, infections - gamma * I, infections
+
+
+def simulate(
+    S,
+    I,
+    beta,
+    gamma,
+    vaccination,
+    days=365,
+    quantiles=QUANTILES,
+    thresholds=THRESHOLDS,
+):
+    """Integrate an ensemble of SIR scenarios for every province at once.
+
+    S and I are each province's starting fractions, shaped (province,);
+    beta, gamma and vaccination are the scenario rates, shaped (scenario,).
+    All (province, scenario) pairs are stepped together with daily RK4
+    steps. Returns quantiles over scenarios of the daily new infections
+    (fraction of the population), shaped (quantile, province, day), and of the
+    days until immunity (1 - S - I) first reaches each threshold, shaped
+    (quantile, province, threshold), with inf where it is not reached.
+    """
+    S, I = (np.asarray(x, dtype="float64")[:, None] for x in (S, I))
+    rates = [
+        np.asarray(x, dtype="float64")[None, :] for x in (beta, gamma, vaccination)
+    ]
+    shape = np.broadcast_shapes(S.shape, rates[0].shape)
+    S, I = np.broadcast_to(S, shape).copy(), np.broadcast_to(I, shape).copy()
+
+    thresholds = np.asarray(thresholds)
+    # Immunity never falls (dR/dt = gamma * I + vaccination * S), so the
+    # first day it reaches a threshold is one plus the number of days below it
+    below = np.zeros((len(thresholds),) + shape, dtype="int32")
+    new_cases = np.empty((len(quantiles), shape[0], days))
+    for day in range(days):
+        dS1, dI1, c1 = derivatives(S, I, *rates)
+        dS2, dI2, c2 = derivatives(S + dS1 / 2, I + dI1 / 2, *rates)
+        dS3, dI3, c3 = derivatives(S + dS2 / 2, I + dI2 / 2, *rates)
+        dS4, dI4, c4 = derivatives(S + dS3, I + dI3, *rates)
+        S += (dS1 + 2 * dS2 + 2 * dS3 + dS4) / 6
+        I += (dI1 + 2 * dI2 + 2 * dI3 + dI4) / 6
+        cases = (c1 + 2 * c2 + 2 * c3 + c4) / 6
+
+        new_cases[:, :, day] = np.quantile(cases, quantiles, axis=1)
+        immunity = 1 - S - I
+        for t, threshold in enumerate(thresholds):
+            below[t] += immunity < threshold
+
+    reached = np.where(below < days, below + 1.0, np.inf)
+    # Interpolating between two infs gives NaN, which is inf here
+    with np.errstate(invalid="ignore"):
+        time_to_threshold = np.quantile(reached, quantiles, axis=2)
+    time_to_threshold = np.nan_to_num(time_to_threshold, nan=np.inf, posinf=np.inf)
+    time_to_threshold = time_to_threshold.transpose(0, 2, 1)
+    return new_cases, time_to_threshold
+
+
+def _simulate_shard(args):
+    return simulate(*args[0], **args[1])
+
+
+@instrument.timed()
+def project(
+    panel,
+    population,
+    scenarios,
+    days=365,
+    workers=None,
+    quantiles=QUANTILES,
+    thresholds=THRESHOLDS,
+):
+    """Project every province forward under an ensemble of scenarios.
+
+    `scenarios` is a dict of beta/gamma/vaccination arrays (see
+    sample_scenarios). With `workers`, provinces are split across a process
+    pool. Returns two long frames: quantiles of projected daily new cases by
+    province and date, and quantiles of the days until each immunity
+    threshold is reached (NaN if not within `days`).
+    """
+    start = initial_state(panel, population)
+    rates = (scenarios["beta"], scenarios["gamma"], scenarios["vaccination"])
+    options = {"days": days, "quantiles": quantiles, "thresholds": thresholds}
+
+    # Provinces are simulated a shard at a time: one per worker, or one per
+    # province when running serially, which keeps each step's arrays small
+    # enough to stay in cache
+    parallel = workers and workers > 1 and len(start) > 1
+    shards = np.array_split(
+        np.arange(len(start)), min(workers, len(start)) if parallel else len(start)
+    )
+    jobs = [((start["S"].iloc[s], start["I"].iloc[s]) + rates, options) for s in shards]
+    if parallel:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_simulate_shard, jobs))
+    else:
+        results = list(map(_simulate_shard, jobs))
+    new_cases = np.concatenate([r[0] for r in results], axis=1)
+    time_to_threshold = np.concatenate([r[1] for r in results], axis=1)
+
+    labels = [f"q{round(q * 100):02d}" for q in quantiles]
+    provinces = start.index.to_numpy()
+    pop = population[provinces].to_numpy(dtype="float64")
+
+    dates = start["Date"].to_numpy()[:, None] + pd.to_timedelta(
+        np.arange(1, days + 1), unit="D"
+    ).to_numpy()[None, :]
+    cases = pd.DataFrame(
+        {
+            "Province": np.repeat(provinces, days),
+            "Date": dates.ravel(),
+            **{
+                label: (new_cases[i] * pop[:, None]).ravel()
+                for i, label in enumerate(labels)
+            },
+        }
+    )
+    times = pd.DataFrame(
+        {
+            "Province": np.repeat(provinces, len(thresholds)),
+            "Threshold": np.tile(thresholds, len(provinces)),
+            **{
+                label: np.where(
+                    np.isinf(time_to_threshold[i]), np.nan, time_to_threshold[i]
+                ).ravel()
+                for i, label in enumerate(labels)
+            },
+        }
+    )
+    return cases, times
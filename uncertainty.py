@@ -0,0 +1,177 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from data import population_of, prefix_sums, province_ranges
+from renewal import estimate_R
+
+# Default assumptions, each sampled uniformly from its range: infections per
+# reported case, the standard deviation of the log of each day's reporting
+# error, and the fraction of vaccinated people who are immune
+UNDER_REPORTING = (1, 6)
+REPORTING_NOISE = (0.05, 0.3)
+VACCINE_EFFECTIVENESS = (0.6, 0.95)
+
+QUANTILES = (0.05, 0.5, 0.95)
+SAMPLES = 10_000
+# Samples per estimate_R call for the renewal estimator, which holds several
+# (sample, day) float64 arrays at once
+RENEWAL_CHUNK = 1000
+
+
+def sample_assumptions(
+    n=SAMPLES,
+    under_reporting=UNDER_REPORTING,
+    noise=REPORTING_NOISE,
+    effectiveness=VACCINE_EFFECTIVENESS,
+    seed=0,
+):
+    rng = np.random.default_rng(seed)
+    return {
+        "under_reporting": rng.uniform(*under_reporting, n),
+        "noise": rng.uniform(*noise, n),
+        "effectiveness": rng.uniform(*effectiveness, n),
+        "seed": seed,
+    }
+
+
+def trailing_mean(values, window):
+    # Mean over the trailing `window` rows of a (day, sample) array, skipping
+    # NaNs, from prefix sums along the day axis. Zeroes the NaNs of `values`.
+    sums, counts = prefix_sums(values)
+    lo = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (sums[1:] - sums[lo]) / (counts[1:] - counts[lo])
+
+
+def sample_bands(
+    counts,
+    population,
+    assumptions,
+    window=7,
+    estimator="SIR",
+    quantiles=QUANTILES,
+    seed=0,
+):
+    """Quantile bands of immunity and R(t) for one province.
+
+    `counts` holds the province's daily series (New Cases, Total Cases,
+    Total Recovered, Total Deaths, Total Vaccinated) as arrays. Every sample
+    scales the reported cases by its under-reporting factor, perturbs each
+    day's new cases by lognormal reporting noise and counts its fraction of
+    vaccinated people as immune. Samples are a second array axis, so each
+    quantity is computed for all of them at once. R(t) is the SIR estimate
+    of data.calculate_R, or the renewal estimate, averaged over `window`
+    days. Returns the quantiles shaped (day, quantity, quantile), with
+    immunity first.
+    """
+    # Samples are float32 throughout: bands need nowhere near float64's
+    # precision, and every (day, sample) array is half the size
+    u = assumptions["under_reporting"].astype("float32")[None, :]
+    sigma = assumptions["noise"].astype("float32")[None, :]
+    effectiveness = assumptions["effectiveness"].astype("float32")[None, :]
+    new = counts["New Cases"].astype("float32")[:, None]
+    n_days, n_samples = len(new), u.shape[1]
+
+    rng = np.random.default_rng(seed)
+    noisy = rng.standard_normal((n_days, n_samples), dtype="float32")
+    noisy *= sigma
+    noisy -= sigma**2 / 2
+    np.exp(noisy, out=noisy)
+    noisy *= new
+    start = counts["Total Cases"][0] - counts["New Cases"][0]
+    total = np.cumsum(noisy, axis=0)
+    total += start
+
+    vaccinated = counts["Total Vaccinated"].astype("float32")[:, None]
+    immunity = u * total
+    immunity += effectiveness * vaccinated
+    immunity /= population
+    np.clip(immunity, 0, 1, out=immunity)
+
+    if estimator == "Renewal":
+        R = np.empty((n_days, n_samples), dtype="float32")
+        for lo in range(0, n_samples, RENEWAL_CHUNK):
+            chunk = slice(lo, lo + RENEWAL_CHUNK)
+            R[:, chunk] = estimate_R(noisy[:, chunk].T, [window])[0][0].T
+    else:
+        # calculate_R's 1 / ((dI/dS + 1) S) reduces to dT / (dRemoved S) for
+        # totals T and removed (recovered plus deaths)
+        removed = counts["Total Recovered"] + counts["Total Deaths"]
+        removed = removed.astype("float32")[:, None]
+        S = 1 - u * total[1:-1] / population
+        R = np.full((n_days, n_samples), np.nan, dtype="float32")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            R[1:-1] = total[2:] - total[:-2]
+            R[1:-1] /= (removed[2:] - removed[:-2]) * S
+        del S
+        R = trailing_mean(np.clip(R, 0, 10, out=R), window)
+
+    return np.stack(
+        [np.quantile(immunity, quantiles, axis=1), np.quantile(R, quantiles, axis=1)]
+    ).transpose(2, 0, 1)
+
+
+def _bands_shard(args):
+    return [sample_bands(*job[0], **job[1]) for job in args]
+
+
+@instrument.timed()
+def bands(
+    panel,
+    population,
+    assumptions=None,
+    window=7,
+    estimator="SIR",
+    quantiles=QUANTILES,
+    workers=None,
+    key="Province",
+):
+    """Monte Carlo bands of immunity and R(t) for every province of a panel.
+
+    `assumptions` comes from sample_assumptions (10,000 samples of the
+    defaults if omitted). Provinces (or the series of another `key`) are
+    processed one at a time, or split across a process pool with `workers`.
+    Returns columns "Immunity q05", "R(t) q95" and so on, on the panel's
+    index.
+    """
+    if assumptions is None:
+        assumptions = sample_assumptions()
+    # Sorted with the caller's labels, which may be a slice of a larger panel
+    index = panel.index
+    panel = panel.sort_values([key, "Date"], kind="stable")
+    ranges = list(province_ranges(panel, key).values())
+    pop = population_of(panel, population, key)
+    columns = ["New Cases", "Total Cases", "Total Recovered", "Total Deaths"]
+    columns += ["Total Vaccinated"]
+    options = {"window": window, "estimator": estimator, "quantiles": quantiles}
+    jobs = [
+        (
+            (
+                {col: panel[col].to_numpy()[lo:hi] for col in columns},
+                pop[lo],
+                assumptions,
+            ),
+            dict(options, seed=[assumptions["seed"], i]),
+        )
+        for i, (lo, hi) in enumerate(ranges)
+    ]
+
+    if workers and workers > 1 and len(jobs) > 1:
+        shards = np.array_split(np.arange(len(jobs)), min(workers, len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_bands_shard, [[jobs[i] for i in s] for s in shards])
+            results = [band for shard in results for band in shard]
+    else:
+        results = [sample_bands(*args, **kwargs) for args, kwargs in jobs]
+
+    labels = [f"q{round(q * 100):02d}" for q in quantiles]
+    names = [f"{kind} {label}" for kind in ["Immunity", "R(t)"] for label in labels]
+    values = np.concatenate(results) if results else np.empty((0, 2, len(labels)))
+    return pd.DataFrame(
+        values.reshape(len(panel), -1).astype("float32"),
+        columns=names,
+        index=panel.index,
+    ).reindex(index)